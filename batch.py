@@ -0,0 +1,89 @@
+# -*- coding: UTF-8 -*-
+"""
+Matching many short strings against one CompiledDFA at once, with NumPy.
+
+The strings are packed into one byte buffer plus offsets, and every step
+advances all the strings still running by one byte with a single fancy
+index into the transition table.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from dfa import as_bytes
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('batch matching needs numpy')
+
+def pack(strings):
+    """
+    Packs strings (str as UTF-8, or bytes) into (buffer, offsets): string i
+    is buffer[offsets[i]:offsets[i + 1]].
+    """
+    _require_numpy()
+    encoded = [as_bytes(s) for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=offsets[1:])
+    buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return buffer, offsets
+
+def _tables(compiled):
+    table = np.asarray(compiled.table, dtype=np.int32)
+    classes = np.frombuffer(bytes(compiled.classes), dtype=np.uint8).astype(np.int64)
+    finals = np.asarray(bytearray(compiled.finals), dtype=bool)
+    return table, classes, finals
+
+def _run(compiled, strings, packed, on_step=None):
+    _require_numpy()
+    buffer, offsets = packed if packed is not None else pack(strings)
+    table, classes, finals = _tables(compiled)
+    ncols = compiled.ncols
+
+    starts = offsets[:-1]
+    lengths = offsets[1:] - starts
+    state = np.full(len(starts), compiled.start, dtype=np.int32)
+
+    # the strings still being read, narrowed as they end or die
+    running = np.nonzero(lengths > 0)[0]
+    column = 0
+    while running.size:
+        step = table[state[running].astype(np.int64) * ncols
+                     + classes[buffer[starts[running] + column]]]
+        state[running] = step
+        column += 1
+
+        running = running[step >= 0]
+        if on_step is not None:
+            on_step(running, state[running], finals, column)
+        running = running[lengths[running] > column]
+
+    return state, finals
+
+def fullmatch_many(compiled, strings=None, packed=None):
+    """
+    Returns a bool array, True where the whole string matches. Give either
+    strings or packed, a (buffer, offsets) pair from pack.
+    """
+    state, finals = _run(compiled, strings, packed)
+    return (state >= 0) & finals[np.maximum(state, 0)]
+
+def match_many(compiled, strings=None, packed=None):
+    """
+    Returns an int array with the end of the longest match at the start of
+    each string, or -1 where there is none.
+    """
+    if packed is None:
+        packed = pack(strings)
+    _, offsets = packed
+
+    finals = np.asarray(bytearray(compiled.finals), dtype=bool)
+    last = np.full(len(offsets) - 1, 0 if finals[compiled.start] else -1, dtype=np.int64)
+
+    def record(running, states, finals, column):
+        last[running[finals[states]]] = column
+
+    _run(compiled, None, packed, record)
+    return last
@@ -0,0 +1,188 @@
+# -*- coding: UTF-8 -*-
+"""
+Benchmarks for each stage of compiling a regex, and for matching.
+
+Every pattern family is a function of a size n. Compiling is timed stage
+by stage through instrument.CompileStats (parse, Thompson construction,
+ε-closures, subset construction, minimization) plus flattening into a
+table, and matching is one linear scan of a generated file for every
+match end, as parallel.match_ends does. Each result records the best time
+over a few runs and the peak memory the stage allocated, measured in a
+separate run under tracemalloc, since tracing slows the code it measures.
+"""
+
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import fsm
+import dfa
+import parallel
+from instrument import CompileStats
+
+def literal(n):
+    return ''.join(chr(ord('a') + i % 26) for i in range(n))
+
+def alternation(n):
+    return '|'.join('k{}'.format(i) for i in range(n))
+
+def nested_stars(n):
+    return '(' * n + 'ab' + ')*' * n
+
+def exponential(n):
+    # (a|b)*a(a|b){n}, spelled out
+    return '(a|b)*a' + '(a|b)' * n
+
+# name: (pattern for n, alphabet of the input, default sizes)
+FAMILIES = {
+    'literal': (literal, 'abcdefghijklmnopqrstuvwxyz', [10, 100, 1000]),
+    'alternation': (alternation, 'k0123456789', [10, 100, 1000]),
+    'nested_stars': (nested_stars, 'ab', [1, 5, 20]),
+    'exponential': (exponential, 'ab', [2, 4, 8, 12]),
+}
+
+STAGES = ['parse', 'thompson', 'closures', 'subset', 'minimize', 'compile']
+
+# counts of states after the stage that built them
+STATE_COUNTS = {
+    'thompson': 'nfa_states',
+    'subset': 'dfa_states',
+    'minimize': 'min_dfa_states',
+}
+
+INPUT_SIZES = [1 << 10, 1 << 20]
+
+def parse_size(text):
+    """'1K', '64M', '1G' or a plain byte count"""
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(text[:-1]) * units[text[-1]]
+    return int(text)
+
+def compile_stats(pattern, trace_memory=False):
+    """CompileStats for compiling pattern into a table once."""
+    stats = CompileStats(trace_memory)
+    min_dfa = fsm.regex_to_dfa(pattern, stats=stats)
+    with stats.stage('compile'):
+        compiled = dfa.compile(min_dfa)
+    stats.count('compiled_states', compiled.nstates)
+    return stats
+
+def bench_compile(family, n, repeat=3):
+    """
+    Results for compiling one member of a family, one per stage.
+    """
+    pattern = FAMILIES[family][0](n)
+
+    best = {}
+    for _ in range(repeat):
+        for stage, seconds in compile_stats(pattern).seconds.items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+
+    traced = compile_stats(pattern, trace_memory=True)
+    counts = traced.counts
+
+    results = []
+    for stage in STAGES:
+        results.append({
+            'family': family, 'n': n, 'stage': stage, 'input_size': None,
+            'seconds': best[stage], 'peak_bytes': traced.peak_memory[stage],
+            'states': counts.get(STATE_COUNTS.get(stage)),
+        })
+    results[-1]['states'] = counts['compiled_states']
+    results[STAGES.index('subset')]['closure_calls'] = counts['closure_calls']
+    results[STAGES.index('minimize')]['refinement_rounds'] = counts['refinement_rounds']
+    return results
+
+def _timed(function, arg):
+    begin = time.perf_counter()
+    value = function(arg)
+    return value, time.perf_counter() - begin
+
+def _traced(function, arg):
+    tracemalloc.start()
+    try:
+        value = function(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return value, peak
+
+def write_input(f, alphabet, size, seed=0):
+    """
+    Writes size bytes of random text over alphabet to f, repeating a block
+    so that gigabyte inputs don't take longer to make than to scan.
+    """
+    rand = random.Random(seed)
+    block = ''.join(rand.choice(alphabet) for _ in range(min(size, 1 << 16))).encode('utf-8')
+    written = 0
+    while written < size:
+        chunk = block[:size - written]
+        f.write(chunk)
+        written += len(chunk)
+
+def bench_match(family, n, size, repeat=3, processes=1, directory=None):
+    """
+    Result for counting the match ends of one member of a family in size
+    bytes of input, read from a mapped file.
+    """
+    pattern_of, alphabet, _ = FAMILIES[family]
+    compiled = parallel.search_dfa(pattern_of(n))
+
+    fd, path = tempfile.mkstemp(suffix='.bench', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_input(f, alphabet, size)
+
+        def scan(_):
+            return sum(1 for _ in parallel.match_ends(compiled, path, processes))
+
+        best = None
+        for _ in range(repeat):
+            matches, seconds = _timed(scan, None)
+            best = seconds if best is None else min(best, seconds)
+        _, peak = _traced(scan, None)
+    finally:
+        os.remove(path)
+
+    return {
+        'family': family, 'n': n, 'stage': 'match', 'input_size': size,
+        'seconds': best, 'peak_bytes': peak, 'states': compiled.nstates,
+        'matches': matches, 'bytes_per_second': size / best if best else None,
+    }
+
+def run(families=None, sizes=None, input_sizes=None, repeat=3, processes=1):
+    """
+    Runs every benchmark, returning a list of result dicts. sizes maps a
+    family to its values of n, defaulting to the family's own.
+    """
+    if families is None:
+        families = sorted(FAMILIES)
+    if input_sizes is None:
+        input_sizes = INPUT_SIZES
+    sizes = sizes or {}
+
+    results = []
+    for family in families:
+        for n in sizes.get(family, FAMILIES[family][2]):
+            results.extend(bench_compile(family, n, repeat))
+            for size in input_sizes:
+                results.append(bench_match(family, n, size, repeat, processes))
+    return results
+
+def _key(result):
+    return (result['family'], result['n'], result['stage'], result['input_size'])
+
+def compare(baseline, results):
+    """
+    Yields (key, baseline seconds, seconds, ratio) for the results that are
+    also in baseline; a ratio above 1 is a slowdown.
+    """
+    before = { _key(r): r['seconds'] for r in baseline }
+    for result in results:
+        key = _key(result)
+        if key in before and before[key]:
+            yield key, before[key], result['seconds'], result['seconds'] / before[key]
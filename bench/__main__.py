@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+"""
+python -m bench [options] > results.json
+
+Runs the benchmarks and writes the results as JSON. With --baseline, stages
+that got slower than in an earlier results file are listed on stderr.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import bench
+
+def revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench')
+    parser.add_argument('--family', action='append', choices=sorted(bench.FAMILIES),
+                        help='pattern family to run (repeatable, default all)')
+    parser.add_argument('--n', type=int, action='append',
+                        help='family size to run (repeatable, default per family)')
+    parser.add_argument('--input-size', type=bench.parse_size, action='append',
+                        help='input to match, like 1K or 1G (repeatable, default 1K and 1M)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs to take the best time of')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes to match with')
+    parser.add_argument('--output', '-o', help='file to write instead of stdout')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.1,
+                        help='slowdown ratio worth reporting')
+    args = parser.parse_args(argv)
+
+    families = args.family or sorted(bench.FAMILIES)
+    sizes = { family: args.n for family in families } if args.n else None
+    results = bench.run(families, sizes, args.input_size, args.repeat, args.processes)
+
+    report = {
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        for key, before, after, ratio in bench.compare(baseline, results):
+            if ratio > args.threshold:
+                family, n, stage, size = key
+                sys.stderr.write('{} n={} {}{}: {:.6f}s -> {:.6f}s ({:.2f}x)\n'.format(
+                    family, n, stage, '' if size is None else ' ' + str(size),
+                    before, after, ratio))
+
+if __name__ == '__main__':
+    main()
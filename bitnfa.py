@@ -0,0 +1,189 @@
+# -*- coding: UTF-8 -*-
+
+import fsm
+from dfa import as_bytes
+
+class BitNFA(object):
+    """
+    Simulates an NFA directly, with the active state set as an int bitmask.
+
+    Each step is an AND with the mask of states that have an edge on the
+    byte, then an OR of those states' precomputed move closures, so matching
+    is O(n·m) however big the equivalent DFA would be. search runs the
+    reversed NFA backwards once to find the leftmost start, then runs
+    forwards from it for the longest end.
+    """
+    def __init__(self, nfa):
+        forward = fsm.ClosureTable(nfa)
+        self.start = forward.closure(forward.bit[nfa.start])
+        self.final = forward.final
+        self.has, self.moves = byte_moves(forward)
+
+        rnfa = reverse(nfa)
+        backward = fsm.ClosureTable(rnfa)
+        self.rstart = backward.closure(backward.bit[rnfa.start])
+        self.rfinal = backward.final
+        self.rhas, self.rmoves = byte_moves(backward)
+
+        self.nstates = len(forward.states)
+
+    def match(self, data, pos=0, endpos=None):
+        """
+        Returns the end of the longest match starting at pos, or None.
+        """
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+        return self._match(data, pos, endpos)
+
+    def fullmatch(self, data, pos=0, endpos=None):
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+
+        has = self.has
+        moves = self.moves
+        active = self.start
+        for i in range(pos, endpos):
+            b = data[i]
+            m = active & has[b]
+            active = 0
+            if not m:
+                return False
+            step = moves[b]
+            while m:
+                low = m & -m
+                active |= step[low]
+                m ^= low
+        return bool(active & self.final)
+
+    def search(self, data, pos=0, endpos=None):
+        """
+        Returns the (start, end) span of the leftmost-longest match, or None.
+        """
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+
+        for start in self._starts(data, pos, endpos):
+            return start, self._match(data, start, endpos)
+        return None
+
+    def finditer(self, data, pos=0, endpos=None):
+        """
+        Yields the spans of successive non-overlapping matches.
+        """
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+
+        resume = pos
+        for start in self._starts(data, pos, endpos):
+            if start < resume:
+                continue
+
+            end = self._match(data, start, endpos)
+            yield start, end
+
+            # step past empty matches so we don't find them again
+            resume = end if end > start else end + 1
+
+    def _match(self, data, pos, endpos):
+        has = self.has
+        moves = self.moves
+        final = self.final
+        active = self.start
+        last = pos if active & final else None
+
+        for i in range(pos, endpos):
+            b = data[i]
+            m = active & has[b]
+            if not m:
+                break
+
+            active = 0
+            step = moves[b]
+            while m:
+                low = m & -m
+                active |= step[low]
+                m ^= low
+
+            if active & final:
+                last = i + 1
+
+        return last
+
+    def _starts(self, data, pos, endpos):
+        """
+        Yields, in order, every position in [pos, endpos] where a match
+        ending at or before endpos starts.
+        """
+        has = self.rhas
+        moves = self.rmoves
+        rstart = self.rstart
+        rfinal = self.rfinal
+
+        # one backward pass; a reverse thread is started at every position
+        starts = bytearray(endpos - pos + 1)
+        active = 0
+        i = endpos
+        while True:
+            active |= rstart
+            if active & rfinal:
+                starts[i - pos] = 1
+            if i == pos:
+                break
+
+            i -= 1
+            b = data[i]
+            m = active & has[b]
+            active = 0
+            step = moves[b]
+            while m:
+                low = m & -m
+                active |= step[low]
+                m ^= low
+
+        offset = starts.find(1)
+        while offset >= 0:
+            yield pos + offset
+            offset = starts.find(1, offset + 1)
+
+    def __repr__(self):
+        return 'BitNFA(<{} states>)'.format(self.nstates)
+
+def byte_moves(table):
+    """
+    Regroups a ClosureTable's steps, which are by character class, by byte:
+    has[b] is the mask of states with an edge on b, and moves[b] maps each such state's bit to its move
+    closure.
+    """
+    has = [0] * 256
+    moves = [{} for _ in range(256)]
+    for low, steps in table.steps.items():
+        for c, mask in steps.items():
+            ranges = table.classes[c].ranges
+            if ranges[0][0] > 255:
+                raise ValueError('Symbol {!r} does not fit in a byte'.format(c))
+            for lo, hi in ranges:
+                for b in range(lo, min(hi, 255) + 1):
+                    has[b] |= low
+                    moves[b][low] = mask
+    return has, moves
+
+def reverse(nfa):
+    """
+    The NFA with every edge flipped, starting from a new state with
+    ε-edges to the old final states and accepting at the old start.
+    """
+    states = nfa.get_states() | {nfa.start} | set(nfa.final)
+    start = max(states) + 1
+
+    rnfa = fsm.IndexedFSM(start=start, final=nfa.start)
+    for s in states:
+        for c, t in nfa.edges(s):
+            rnfa.add_transition(t, c, s)
+    for f in nfa.final:
+        rnfa.add_transition(start, None, f)
+
+    return rnfa
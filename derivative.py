@@ -0,0 +1,238 @@
+# -*- coding: UTF-8 -*-
+"""
+DFAs straight from the parse tree, by Brzozowski derivatives.
+
+The derivative of a regex r by a symbol c matches the rest of every match
+of r that starts with c. Taking derivatives of the regex, then of those,
+and so on, reaches every DFA state as a regex of its own, with no NFA and,
+because the constructors below simplify as they go, usually close to the
+minimal number of states.
+"""
+
+import collections as col
+
+import fsm
+import reparse as rep
+import utf8
+
+class Derivatives(object):
+    """
+    The derivatives of one regex, worked out as they're asked for.
+
+    Terms are ints indexing self.nodes, and the constructors intern every
+    node, so equal terms are equal ints and the memo of derivatives is a
+    dict keyed by (term, symbol). Alternations are sets (so associative,
+    commutative and idempotent) with their character sets merged;
+    sequences are flat; ∅ and ε are dropped where they change nothing. The
+    symbols are the classes of self.classes, over UTF-8 bytes unless
+    utf8=False. Since nothing is built before it's needed, derive also
+    works for stepping through a DFA lazily.
+    """
+    # node formats: ('0',) ('e',) ('c', CharSet) ('.', (t, ...))
+    #               ('|', frozenset({t, ...})) ('*', t)
+    EMPTY = 0
+    EPSILON = 1
+
+    def __init__(self, tree, utf8=True):
+        self.utf8 = utf8
+        self.nodes = []
+        self.ids = {}
+        self.nullable = []
+        self.memo = {}
+        self.terms = {}     # { parse tree node: term }
+
+        self._intern(('0',), False)
+        self._intern(('e',), True)
+        self.start = self.from_tree(tree)
+
+        # every set a derivative can test is a union of these
+        self.classes, _ = fsm.partition(
+            node[1] for node in self.nodes if node[0] == 'c'
+        )
+
+    def _intern(self, node, nullable):
+        term = self.ids.get(node)
+        if term is None:
+            term = self.ids[node] = len(self.nodes)
+            self.nodes.append(node)
+            self.nullable.append(nullable)
+        return term
+
+    def chars(self, charset):
+        if not len(charset):
+            return self.EMPTY
+        return self._intern(('c', charset), False)
+
+    def seq(self, terms):
+        items = []
+        for t in terms:
+            node = self.nodes[t]
+            if node[0] == '.':
+                items.extend(node[1])
+            elif t == self.EMPTY:
+                return self.EMPTY
+            elif t != self.EPSILON:
+                items.append(t)
+
+        if not items:
+            return self.EPSILON
+        if len(items) == 1:
+            return items[0]
+        nullable = all(self.nullable[t] for t in items)
+        return self._intern(('.', tuple(items)), nullable)
+
+    def alt(self, terms):
+        members = set()
+        charsets = []
+        todo = list(terms)
+        while todo:
+            t = todo.pop()
+            node = self.nodes[t]
+            if node[0] == '|':
+                todo.extend(node[1])
+            elif node[0] == 'c':
+                charsets.append(node[1])
+            elif t != self.EMPTY:
+                members.add(t)
+
+        # [ab]|[bc] is [abc]
+        if charsets:
+            ranges = [r for charset in charsets for r in charset.ranges]
+            members.add(self.chars(rep.CharSet(ranges)))
+
+        if not members:
+            return self.EMPTY
+        if len(members) == 1:
+            return members.pop()
+        nullable = any(self.nullable[t] for t in members)
+        return self._intern(('|', frozenset(members)), nullable)
+
+    def star(self, t):
+        if t == self.EMPTY or t == self.EPSILON:
+            return self.EPSILON
+        if self.nodes[t][0] == '*':
+            return t
+        return self._intern(('*', t), True)
+
+    def from_tree(self, tree):
+        """
+        The term for a reparse tree, built bottom up. Parse tree nodes are
+        interned, so a subtree that appears again is looked up in
+        self.terms instead of being built again.
+        """
+        terms = self.terms
+        # (node, children done)
+        todo = [(tree, False)]
+        done = []
+        while todo:
+            node, ready = todo.pop()
+            kind = type(node)
+
+            if not ready and node in terms:
+                done.append(terms[node])
+                continue
+
+            if kind is rep.Primitive:
+                term = self.charclass(rep.CharSet.of(node.c))
+            elif kind is rep.CharClass:
+                term = self.charclass(node.chars)
+            elif ready and kind is rep.Star:
+                term = self.star(done.pop())
+            elif ready:
+                b = done.pop()
+                a = done.pop()
+                term = self.seq([a, b]) if kind is rep.Concat else self.alt([a, b])
+            elif kind is rep.Star:
+                todo.append((node, True))
+                todo.append((node.a, False))
+                continue
+            elif kind is rep.Concat or kind is rep.Or:
+                todo.append((node, True))
+                todo.append((node.b, False))
+                todo.append((node.a, False))
+                continue
+            else:
+                term = self.EPSILON
+
+            terms[node] = term
+            done.append(term)
+
+        return done.pop()
+
+    def charclass(self, charset):
+        """The term for a character class, as UTF-8 byte sequences if utf8."""
+        if not self.utf8 or charset.ranges[-1][1] <= 0x7F:
+            return self.chars(charset)
+
+        return self.alt(
+            self.seq([self.chars(rep.CharSet([byte_range])) for byte_range in run])
+            for lo, hi in charset.ranges
+            for run in utf8.sequences(lo, hi)
+        )
+
+    def derive(self, t, c):
+        """The derivative of term t by symbol c, a class representative."""
+        key = (t, c)
+        result = self.memo.get(key)
+        if result is not None:
+            return result
+
+        node = self.nodes[t]
+        kind = node[0]
+        if kind == 'c':
+            result = self.EPSILON if c in node[1] else self.EMPTY
+        elif kind == '.':
+            # d(xy) = d(x)y, or d(x)y | d(y) when x can be empty, and so on
+            items = node[1]
+            branches = []
+            for i, item in enumerate(items):
+                branches.append(self.seq((self.derive(item, c),) + items[i + 1:]))
+                if not self.nullable[item]:
+                    break
+            result = self.alt(branches)
+        elif kind == '|':
+            result = self.alt(self.derive(u, c) for u in node[1])
+        elif kind == '*':
+            result = self.seq([self.derive(node[1], c), t])
+        else:
+            result = self.EMPTY
+
+        self.memo[key] = result
+        return result
+
+    def to_fsm(self, max_states=None):
+        """
+        The DFA whose states are the derivatives reachable from the start,
+        canonically numbered. Raises ValueError past max_states states.
+        """
+        symbols = sorted(self.classes)
+        dfa = fsm.FSM()
+        dfa.classes = self.classes
+
+        index = { self.start: 0 }
+        queue = col.deque([self.start])
+        while queue:
+            t = queue.popleft()
+            s = index[t]
+            if self.nullable[t]:
+                dfa.final.add(s)
+
+            for c in symbols:
+                u = self.derive(t, c)
+                if u == self.EMPTY:
+                    continue
+
+                if u not in index:
+                    if max_states is not None and len(index) >= max_states:
+                        raise ValueError('DFA needs more than {} states'.format(max_states))
+                    index[u] = len(index)
+                    queue.append(u)
+                dfa.add_transition(s, c, index[u])
+
+        dfa.start = 0
+        dfa.prettify()
+        return dfa
+
+def regex_to_dfa(regex, utf8=True, max_states=None):
+    tree = rep.REParser(regex).parse()
+    return Derivatives(tree, utf8).to_fsm(max_states)
@@ -0,0 +1,169 @@
+# -*- coding: UTF-8 -*-
+
+from array import array
+
+from fsm import ranges_of
+
+def as_bytes(data):
+    """str is matched as its UTF-8 encoding; anything bytes-like as is"""
+    if isinstance(data, str):
+        return data.encode('utf-8')
+    return data
+
+class CompiledDFA(object):
+    """
+    A DFA flattened into one transition table, in the spirit of
+    nfa2.build_dfa_tables but without a list per state.
+
+    Bytes the DFA never tells apart share a table column: classes[byte] is
+    the byte's column, and table[state * ncols + classes[byte]] is the next
+    state, or -1 where the DFA has no transition. finals[state] is 1 for
+    accepting states, and for DFAs built from several patterns tags[state]
+    is the pattern a state accepts, or -1. Matching is one table lookup per
+    byte and allocates nothing per byte.
+
+    search and finditer only try the starts a literals.Prefilter, if one is
+    set as prefilter, lets through.
+    """
+    def __init__(self, table, finals, start=0, tags=None, classes=None):
+        self.table = table
+        self.finals = finals
+        self.start = start
+        self.tags = tags
+        self.classes = bytes(range(256)) if classes is None else classes
+        self.ncols = max(self.classes) + 1
+        self.nstates = len(finals)
+        self.prefilter = None
+
+    def match(self, data, pos=0, endpos=None):
+        """
+        Returns the end of the longest match starting at pos, or None.
+        """
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+        return self._match(data, pos, endpos)
+
+    def fullmatch(self, data, pos=0, endpos=None):
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+
+        table = self.table
+        classes = self.classes
+        ncols = self.ncols
+        state = self.start
+        for i in range(pos, endpos):
+            state = table[state * ncols + classes[data[i]]]
+            if state < 0:
+                return False
+        return bool(self.finals[state])
+
+    def search(self, data, pos=0, endpos=None):
+        """
+        Returns the (start, end) span of the leftmost-longest match, or None.
+        """
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+        return self._search(data, pos, endpos)
+
+    def finditer(self, data, pos=0, endpos=None):
+        """
+        Yields the spans of successive non-overlapping matches.
+        """
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+
+        while pos <= endpos:
+            span = self._search(data, pos, endpos)
+            if span is None:
+                return
+            yield span
+
+            # step past empty matches so we don't find them again
+            start, pos = span
+            if pos == start:
+                pos += 1
+
+    def _match(self, data, pos, endpos):
+        table = self.table
+        classes = self.classes
+        ncols = self.ncols
+        finals = self.finals
+        state = self.start
+        last = pos if finals[state] else None
+
+        for i in range(pos, endpos):
+            state = table[state * ncols + classes[data[i]]]
+            if state < 0:
+                break
+            if finals[state]:
+                last = i + 1
+
+        return last
+
+    def _search(self, data, pos, endpos):
+        starts = range(pos, endpos + 1)
+        if self.prefilter is not None and hasattr(data, 'find'):
+            starts = self.prefilter.candidates(data, pos, endpos)
+
+        for start in starts:
+            end = self._match(data, start, endpos)
+            if end is not None:
+                return start, end
+        return None
+
+    def __repr__(self):
+        return 'CompiledDFA(<{} states>, start={}, ncols={})'.format(
+            self.nstates, self.start, self.ncols)
+
+def compile(fsm):
+    """
+    Flattens a DFA (FSM or IndexedFSM) into a CompiledDFA. Symbols are
+    characters or character classes, and must have some character below
+    256; the DFA start state becomes state 0.
+    """
+    others = sorted(fsm.get_states() - {fsm.start})
+    number = { s: i for i, s in enumerate([fsm.start] + others) }
+    classes = getattr(fsm, 'classes', {})
+
+    # rows format: [ [next state for each byte] ], one per state
+    rows = [[-1] * 256 for _ in number]
+    finals = bytearray(len(number))
+    tags = array('i', [-1]) * len(number) if fsm.tags else None
+
+    for s, i in number.items():
+        row = rows[i]
+        for c, t in fsm.edges(s):
+            if c is None:
+                raise ValueError('Not a DFA: ε-transition out of {}'.format(s))
+
+            ranges = ranges_of(classes.get(c, c))
+            if ranges[0][0] > 255:
+                raise ValueError('Symbol {!r} does not fit in a byte table'.format(c))
+
+            for lo, hi in ranges:
+                for b in range(lo, min(hi, 255) + 1):
+                    row[b] = number[t]
+
+        if s in fsm.final:
+            finals[i] = 1
+            if s in fsm.tags:
+                tags[i] = fsm.tags[s]
+
+    # bytes that go to the same states everywhere share a column
+    columns = {}
+    byte_classes = bytearray(256)
+    for b in range(256):
+        column = tuple(row[b] for row in rows)
+        byte_classes[b] = columns.setdefault(column, len(columns))
+
+    ncols = len(columns)
+    table = array('i', [-1]) * (len(number) * ncols)
+    for column, j in columns.items():
+        for i, t in enumerate(column):
+            table[i * ncols + j] = t
+
+    return CompiledDFA(table, finals, tags=tags, classes=bytes(byte_classes))
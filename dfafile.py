@@ -0,0 +1,189 @@
+# -*- coding: UTF-8 -*-
+"""
+Reading and writing automata.
+
+The binary format holds a CompiledDFA:
+
+    header     MAGIC, then little-endian version, flags, nstates, start,
+               ncols and a reserved word
+    alphabet   256 bytes, the table column for each input byte
+    finals     nstates bytes, padded to a multiple of 8
+    table      nstates * ncols int32s, in the byte order flags names
+    tags       nstates int32s, if flags has HAS_TAGS
+
+load maps the file and matches straight out of the mapping, without
+copying the table. The edge list (nfa.txt) and nfa2 triple (nfa.json)
+formats are read and written as FSMs.
+"""
+
+import ast
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+import fsm
+from dfa import CompiledDFA
+
+MAGIC = b'CDFA'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHIIII')
+
+# flags
+LITTLE_ENDIAN = 0x1
+HAS_TAGS = 0x2
+
+EPSILON = 'ε'
+
+def _native_flags():
+    return LITTLE_ENDIAN if sys.byteorder == 'little' else 0
+
+def _padded(n):
+    return (n + 7) & ~7
+
+def dumps(compiled):
+    """Serializes a CompiledDFA to bytes."""
+    nstates = len(compiled.finals)
+    table = array('i', compiled.table)
+    if table.itemsize != 4:
+        raise ValueError('Tables need 32-bit ints, this platform has {}-byte ones'
+                         .format(table.itemsize))
+
+    flags = _native_flags()
+    sections = [bytes(compiled.classes), bytes(compiled.finals).ljust(_padded(nstates), b'\0'),
+                table.tobytes()]
+    if compiled.tags is not None:
+        flags |= HAS_TAGS
+        sections.append(array('i', compiled.tags).tobytes())
+
+    header = HEADER.pack(MAGIC, VERSION, flags, nstates, compiled.start, compiled.ncols, 0)
+    return header + b''.join(sections)
+
+def dump(compiled, f):
+    f.write(dumps(compiled))
+
+def save(compiled, path):
+    with open(path, 'wb') as f:
+        dump(compiled, f)
+
+def loads(buffer):
+    """
+    Builds a CompiledDFA over buffer (bytes, mmap, ...), sharing its memory
+    when the table's byte order is native.
+    """
+    view = memoryview(buffer)
+    if len(view) < HEADER.size:
+        raise ValueError('Truncated automaton: no header')
+
+    magic, version, flags, nstates, start, ncols, _ = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError('Not a compiled automaton: bad magic {!r}'.format(magic))
+    if version != VERSION:
+        raise ValueError('Unsupported automaton format version {}'.format(version))
+
+    offset = HEADER.size
+    alphabet = bytes(view[offset:offset + 256])
+    offset += 256
+    if len(alphabet) < 256 or ncols != max(alphabet) + 1:
+        raise ValueError('Alphabet map does not match {} table columns'.format(ncols))
+
+    finals = view[offset:offset + nstates]
+    offset += _padded(nstates)
+
+    size = nstates * ncols * 4
+    if len(view) < offset + size:
+        raise ValueError('Truncated automaton: table needs {} bytes, {} left'
+                         .format(size, len(view) - offset))
+    if start >= max(nstates, 1):
+        raise ValueError('Start state {} out of range'.format(start))
+
+    table = _int32s(view[offset:offset + size], flags)
+    offset += size
+
+    tags = None
+    if flags & HAS_TAGS:
+        size = nstates * 4
+        if len(view) < offset + size:
+            raise ValueError('Truncated automaton: tags need {} bytes, {} left'
+                             .format(size, len(view) - offset))
+        tags = _int32s(view[offset:offset + size], flags)
+
+    compiled = CompiledDFA(table, finals, start, tags, alphabet)
+
+    # the views are only good while the buffer is
+    compiled.buffer = buffer
+    return compiled
+
+def _int32s(view, flags):
+    if (flags & LITTLE_ENDIAN) == _native_flags():
+        return view.cast('i')
+
+    ints = array('i')
+    ints.frombytes(view)
+    ints.byteswap()
+    return ints
+
+def load(path):
+    """Maps the file at path and matches directly out of the mapping."""
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return loads(buffer)
+
+# nfa.txt: one "from  symbol  to" line per edge, then start: and end: lines
+
+def load_edge_list(path):
+    nfa = fsm.FSM()
+    with open(path, encoding='utf-8') as f:
+        for lineno, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields:
+                continue
+            elif fields[0] == 'start:':
+                nfa.start = int(fields[1])
+            elif fields[0] == 'end:':
+                nfa.final.update(int(s) for s in fields[1:])
+            elif len(fields) == 3:
+                s, c, t = fields
+                nfa.add_transition(int(s), None if c == EPSILON else c, int(t))
+            else:
+                raise ValueError('{}:{}: bad edge line {!r}'.format(path, lineno, line))
+    return nfa
+
+def dump_edge_list(nfa, f):
+    for s in sorted(nfa.get_states()):
+        for c, t in nfa.edges(s):
+            f.write('{}   {}   {}\n'.format(s, EPSILON if c is None else c, t))
+    f.write('start: {}\n'.format(nfa.start))
+    f.write('end: {}\n'.format(' '.join(str(s) for s in sorted(nfa.final))))
+
+# nfa.json: nfa2's (table, start, end) triple, written as a Python literal
+# like the file in the repo; JSON arrays are read too
+
+def load_triple(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    try:
+        table, start, end = json.loads(text)
+    except ValueError:
+        table, start, end = ast.literal_eval(text)
+
+    nfa = fsm.FSM(start=start, final=end)
+    for s, translist in enumerate(table):
+        for c, t in translist:
+            nfa.add_transition(s, c, t)
+    return nfa
+
+def dump_triple(nfa, f):
+    if len(nfa.final) != 1:
+        raise ValueError('nfa2 triples have one end state, this FSM has {}'
+                         .format(len(nfa.final)))
+
+    states = nfa.get_states() | {nfa.start} | nfa.final
+    table = [[] for _ in range(max(states) + 1)]
+    for s in states:
+        table[s] = [(c, t) for c, t in nfa.edges(s)]
+
+    end, = nfa.final
+    f.write(repr((table, nfa.start, end)))
@@ -6,9 +6,71 @@ import collections as col
 import operator as op
 import itertools
 import pprint
+import hashlib
+from array import array
+
+import utf8
+import simplify as simp
+from instrument import NO_STATS
+
+def ranges_of(symbol):
+    """a label's characters as code point ranges, single characters included"""
+    if type(symbol) is rep.CharSet:
+        return symbol.ranges
+    return ((ord(symbol), ord(symbol)),)
+
+def matches(label, symbol):
+    """whether an edge label (a character or CharSet) takes symbol"""
+    return label == symbol or (type(label) is rep.CharSet and symbol in label)
+
+def partition(labels):
+    """
+    Splits the characters the labels cover into classes that no label
+    tells apart.
+    
+    Returns (classes, members): classes maps each class's representative,
+    its lowest character, to a CharSet of the class; members maps each
+    label to the representatives of the classes it covers.
+    """
+    # sweep the range boundaries, tracking which labels cover each stretch
+    events = col.defaultdict(list)
+    for label in labels:
+        for lo, hi in ranges_of(label):
+            events[lo].append((label, 1))
+            events[hi + 1].append((label, -1))
+    
+    cover = col.Counter()
+    stretches = col.defaultdict(list)
+    points = sorted(events)
+    for lo, hi in zip(points, points[1:]):
+        for label, delta in events[lo]:
+            cover[label] += delta
+            if not cover[label]:
+                del cover[label]
+        if cover:
+            stretches[frozenset(cover)].append((lo, hi - 1))
+    
+    classes = {}
+    members = col.defaultdict(list)
+    for signature, ranges in stretches.items():
+        representative = chr(ranges[0][0])
+        classes[representative] = rep.CharSet(ranges)
+        for label in signature:
+            members[label].append(representative)
+    
+    return classes, dict(members)
+
+def classify(classes, symbol):
+    """the representative of symbol's class, or symbol if it has none"""
+    if not classes or symbol is None or symbol in classes:
+        return symbol
+    for representative, chars in classes.items():
+        if symbol in chars:
+            return representative
+    return symbol
 
 class FSM(object):
-    def __init__(self, transtable=None, start=0, final=None):
+    def __init__(self, transtable=None, start=0, final=None, tags=None):
         # transitions format: { 0: [(None, 1), ('a', 2)] }
         #                     { s: [(c, t)] }
         self.transtable = transtable or {}
@@ -21,6 +83,14 @@ class FSM(object):
                 self.final = set(final)
             except TypeError:
                 self.final = {final}
+        
+        # which pattern a final state accepts, lower is higher priority
+        # tags format: { s: tag }
+        self.tags = dict(tags or {})
+        
+        # for DFAs over character classes, what each label stands for
+        # classes format: { c: CharSet }
+        self.classes = {}
                 
     def add_transition(self, s, c, t):
         if s not in self.transtable:
@@ -45,11 +115,15 @@ class FSM(object):
         alphabet.discard(None)
         return alphabet
     
+    def edges(self, state):
+        return self.transtable.get(state, ())
+    
     def move(self, state, symbol):
+        symbol = classify(self.classes, symbol)
         result = set()
         if state in self.transtable:
             for c, t in self.transtable[state]:
-                if c == symbol:
+                if matches(c, symbol):
                     result.add(t)
         return result
     
@@ -74,6 +148,8 @@ class FSM(object):
                 return s1
             else:
                 return s
+        
+        self.tags = { st(s): tag for s, tag in self.tags.items() }
 
         self.transtable = {
             st(k): [ (c, st(t)) for c, t in translist ]
@@ -82,33 +158,41 @@ class FSM(object):
     
     def prettify(self):
         """
-        Rearranges the nodes to flow more intuitively for humans
+        Rearranges the nodes to flow more intuitively for humans: the start
+        node becomes 0 and the rest are numbered breadth-first, following
+        symbols in sorted order. Equivalent machines come out identical.
         """
-                
-        # start on 0
-        self.swap_nodes(self.start, 0)
-        print(self)
-        translations = { 0: 0 }
+        translations = { self.start: 0 }
+        queue = col.deque([self.start])
+        
+        # states nothing leads to still need a number, after the rest
+        unreached = sorted(self.get_states() - {self.start})
         
         new_transitions = col.defaultdict(list)
-        for from_state, transitions in sorted(self.transtable.items()):
+        while queue:
+            from_state = queue.popleft()
             
-            if from_state not in translations:
-                translations[from_state] = len(translations)
-            
-            for c, to_state in transitions:
+            for c, to_state in sorted(self.transtable.get(from_state, ())):
                 if to_state not in translations:
                     translations[to_state] = len(translations)
+                    queue.append(to_state)
                 
                 new_transitions[translations[from_state]].append((c, translations[to_state]))
             
-            print('\ntranslations')
-            pprint.pprint(translations)
-            print('\nnew_transitions')
-            pprint.pprint(new_transitions)
+            if not queue:
+                for s in unreached:
+                    if s not in translations:
+                        translations[s] = len(translations)
+                        queue.append(s)
+                        break
         
         self.transtable = dict(new_transitions)
-        self.final = { translations[s] for s in self.final }
+        self.start = 0
+        self.final = { translations[s] for s in self.final if s in translations }
+        self.tags = { 
+            translations[s]: tag 
+            for s, tag in self.tags.items() if s in translations 
+        }
         
     
     def __str__(self):
@@ -123,16 +207,187 @@ class FSM(object):
         return output 
     
     def __repr__(self):
+        if self.tags:
+            return 'FSM({}, {}, {}, {})'.format(
+                self.transtable, self.start, self.final, self.tags)
         return 'FSM({}, {}, {})'.format(self.transtable, self.start, self.final)
+    
+    def to_indexed(self):
+        indexed = IndexedFSM(self.transtable, self.start, self.final, self.tags)
+        indexed.classes = dict(self.classes)
+        return indexed
+    
+    def fingerprint(self):
+        """
+        Hash of the machine's structure. Minimized DFAs come out of
+        NFADFAConverter canonically numbered, so any two for the same
+        language have the same fingerprint.
+        """
+        # the characters each edge takes, however they were split into labels
+        transitions = []
+        for s, translist in sorted(self.transtable.items()):
+            chars = col.defaultdict(list)
+            for c, t in translist:
+                if c is None:
+                    chars[t].append((-1, -1))
+                else:
+                    chars[t].extend(ranges_of(self.classes.get(c, c)))
+            transitions.append((s, sorted(
+                (t, rep.CharSet(ranges).ranges) for t, ranges in chars.items()
+            )))
+        
+        structure = repr((transitions, self.start, sorted(self.final), 
+                          sorted(self.tags.items())))
+        return hashlib.sha1(structure.encode('utf-8')).hexdigest()
+    
+    def compile(self):
+        """flattens a DFA into a dense-table matcher, see dfa.compile"""
+        import dfa
+        return dfa.compile(self)
+
+class IndexedFSM(object):
+    """
+    FSM with each state's transitions indexed by symbol and ε-edges kept
+    apart, for the converters' hot paths. The state set and alphabet are
+    kept up to date as transitions are added; to_fsm gives back the list
+    format.
+    """
+    def __init__(self, transtable=None, start=0, final=None, tags=None):
+        # trans format:   { s: { c: {t, ...} } }
+        # epsilon format: { s: {t, ...} }
+        self.trans = {}
+        self.epsilon = {}
+        self.states = set()
+        self.alphabet = set()
+        self.start = start
+        
+        if final is None:
+            self.final = set()
+        else:
+            try:
+                self.final = set(final)
+            except TypeError:
+                self.final = {final}
+        
+        self.tags = dict(tags or {})
+        self.classes = {}
+        
+        for s, translist in (transtable or {}).items():
+            for c, t in translist:
+                self.add_transition(s, c, t)
+    
+    def add_transition(self, s, c, t):
+        self.states.add(s)
+        self.states.add(t)
+        if c is None:
+            self.epsilon.setdefault(s, set()).add(t)
+        else:
+            self.trans.setdefault(s, {}).setdefault(c, set()).add(t)
+            self.alphabet.add(c)
+    
+    def add_edges(self, src, sym, dst):
+        """
+        Adds the edges src[i] --sym[i]--> dst[i] in one pass.
+        """
+        trans = self.trans
+        epsilon = self.epsilon
+        for s, c, t in zip(src, sym, dst):
+            if c is None:
+                targets = epsilon.get(s)
+                if targets is None:
+                    epsilon[s] = {t}
+                else:
+                    targets.add(t)
+            else:
+                row = trans.get(s)
+                if row is None:
+                    row = trans[s] = {}
+                targets = row.get(c)
+                if targets is None:
+                    row[c] = {t}
+                else:
+                    targets.add(t)
+        
+        self.states.update(src)
+        self.states.update(dst)
+        self.alphabet.update(c for c in sym if c is not None)
+    
+    def get_states(self):
+        """the live state set; don't modify it"""
+        return self.states
+    
+    def get_alphabet(self):
+        """the live alphabet; don't modify it"""
+        return self.alphabet
+    
+    def edges(self, state):
+        for t in self.epsilon.get(state, ()):
+            yield None, t
+        for c, targets in self.trans.get(state, {}).items():
+            for t in targets:
+                yield c, t
+    
+    def move(self, state, symbol):
+        if symbol is None:
+            return set(self.epsilon.get(state, ()))
+        
+        row = self.trans.get(state, {})
+        symbol = classify(self.classes, symbol)
+        if symbol in row:
+            return set(row[symbol])
+        
+        result = set()
+        for c, targets in row.items():
+            if matches(c, symbol):
+                result.update(targets)
+        return result
+    
+    def to_fsm(self):
+        transtable = {}
+        for s in self.states:
+            translist = list(self.edges(s))
+            if translist:
+                transtable[s] = translist
+        fsm = FSM(transtable, self.start, self.final, self.tags)
+        fsm.classes = dict(self.classes)
+        return fsm
+    
+    def compile(self):
+        """flattens a DFA into a dense-table matcher, see dfa.compile"""
+        import dfa
+        return dfa.compile(self)
+    
+    def __str__(self):
+        return str(self.to_fsm())
+    
+    def __repr__(self):
+        return 'IndexedFSM({}, {}, {})'.format(
+            self.to_fsm().transtable, self.start, self.final)
         
 class RegexNFAConverter(object):
-    def __init__(self, regex):
+    """
+    Builds NFAs from regexes. With utf8 (the default) the NFA reads UTF-8
+    bytes, one character below 256 per byte, and non-ASCII characters and
+    classes become paths of byte edges; otherwise it reads characters.
+    Parsed trees are simplified first (see simplify) unless simplify=False.
+    stats is an instrument.CompileStats to report to.
+    """
+    def __init__(self, regex=None, utf8=True, stats=None, simplify=True):
         self.regex = regex
+        self.utf8 = utf8
+        self.simplify = simplify
+        self.stats = NO_STATS if stats is None else stats
         self.counter = 0  # used to track state
         
-        self.tree = self.regex_to_tree(self.regex)
+        # without a regex, fragments are added with explicit trees and states
+        self.tree = None if regex is None else self.regex_to_tree(self.regex)
+        
+        self.fsm = IndexedFSM()
         
-        self.fsm = FSM()
+        # states that read the rest of a UTF-8 sequence, shared by every
+        # sequence with the same tail into the same state
+        # suffixes format: { (lo, hi, t): s }
+        self.suffixes = {}
     
     def new_state(self):
         state = self.counter
@@ -140,9 +395,28 @@ class RegexNFAConverter(object):
         return state
         
     def regex_to_tree(self, regex):
-        return rep.REParser(regex).parse()
+        with self.stats.stage('parse'):
+            tree = rep.REParser(regex).parse()
+        if self.simplify:
+            with self.stats.stage('simplify'):
+                tree = simp.simplify(tree)
+        return tree
     
     def tree_to_nfa(self, tree=None, start_state=None, end_state=None):
+        """
+        Thompson's construction, walking the tree with an explicit stack.
+        
+        The tree is sized first, so every new state is numbered and every
+        edge has a slot in flat arrays before any is filled in; the edges go
+        into the FSM in one bulk add.
+        """
+        counter = self.counter
+        with self.stats.stage('thompson'):
+            nfa = self._thompson(tree, start_state, end_state)
+        self.stats.count('nfa_states', self.counter - counter)
+        return nfa
+    
+    def _thompson(self, tree, start_state, end_state):
         if tree is None:
             tree = self.tree
         
@@ -153,47 +427,414 @@ class RegexNFAConverter(object):
             end_state = self.new_state()
             self.fsm.final = {end_state}
         
-        if type(tree) is rep.Primitive:
-            self.fsm.add_transition(start_state, tree.c, end_state)
+        nstates, nedges = thompson_size(tree)
+        state = self.counter
+        self.counter += nstates
+        
+        # edge i is src[i] --sym[i]--> dst[i], sym None for ε
+        src = array('i', [0]) * nedges
+        dst = array('i', [0]) * nedges
+        sym = [None] * nedges
+        e = 0
+        
+        # non-ASCII edges, added as byte paths once the tree is done
+        wide = []
+        
+        # (tree, fragment start, fragment end)
+        todo = [(tree, start_state, end_state)]
+        while todo:
+            node, s, t = todo.pop()
+            kind = type(node)
             
-        elif type(tree) is rep.Star:
-            s1 = self.new_state()
+            if kind is rep.Primitive:
+                if self.utf8 and ord(node.c) > 0x7F:
+                    wide.append((s, rep.CharSet.of(node.c), t))
+                    continue
+                
+                src[e] = s
+                sym[e] = node.c
+                dst[e] = t
+                e += 1
+                
+            elif kind is rep.CharClass:
+                if self.utf8 and node.chars.ranges[-1][1] > 0x7F:
+                    wide.append((s, node.chars, t))
+                    continue
+                
+                src[e] = s
+                sym[e] = node.chars
+                dst[e] = t
+                e += 1
+                
+            elif kind is rep.Star:
+                # ε-transition to fragment/out
+                src[e] = s
+                dst[e] = state
+                src[e + 1] = s
+                dst[e + 1] = t
+                e += 2
+                
+                # populate the fragment, loop back to start
+                todo.append((node.a, state, s))
+                state += 1
+                
+            elif kind is rep.Concat:
+                # second fragment, then first
+                todo.append((node.b, state, t))
+                todo.append((node.a, s, state))
+                state += 1
+                
+            elif kind is rep.Or:
+                # a branch each
+                src[e] = s
+                dst[e] = state
+                src[e + 1] = s
+                dst[e + 1] = state + 1
+                e += 2
+                
+                todo.append((node.b, state + 1, t))
+                todo.append((node.a, state, t))
+                state += 2
+                
+            else:
+                # the empty regex is a plain ε-transition
+                src[e] = s
+                dst[e] = t
+                e += 1
+        
+        # the deferred edges left their slots unused
+        del src[e:], sym[e:], dst[e:]
+        self.fsm.add_edges(src, sym, dst)
+        
+        for s, chars, t in wide:
+            self.add_utf8_edges(s, chars, t)
+        return self.fsm
+    
+    def tree_to_glushkov(self, tree=None, start_state=None):
+        """
+        Glushkov's position automaton: one state per character or class in
+        the tree (a position) plus the start state, and no ε-transitions.
+        
+        Bottom up, each node gets whether it is nullable and the masks of
+        the positions its matches can start (first) and end (last) on;
+        follow[p] collects the positions that can come right after p. Edges
+        into a position read its label.
+        """
+        if tree is None:
+            tree = self.tree
+        
+        if start_state is None:
+            start_state = self.new_state()
+            self.fsm.start = start_state
+        
+        counter = self.counter
+        with self.stats.stage('glushkov'):
+            labels, follow, (nullable, first, last) = glushkov_sets(tree)
+            states = [self.new_state() for _ in labels]
             
-            # ε-transition to fragment/out
-            self.fsm.add_transition(start_state, None, s1)
-            self.fsm.add_transition(start_state, None, end_state)
+            wide = []
+            src = []
+            sym = []
+            dst = []
+            for s, mask in [(start_state, first)] + list(zip(states, follow)):
+                for q in _positions(mask):
+                    label = labels[q]
+                    if self.utf8 and _is_wide(label):
+                        wide.append((s, label, states[q]))
+                    else:
+                        src.append(s)
+                        sym.append(label)
+                        dst.append(states[q])
             
-            # populate the fragment, loop back to start
-            self.tree_to_nfa(tree.a, s1, start_state)
+            self.fsm.add_edges(src, sym, dst)
+            for s, label, t in wide:
+                if type(label) is not rep.CharSet:
+                    label = rep.CharSet.of(label)
+                self.add_utf8_edges(s, label, t)
             
-        elif type(tree) is rep.Concat:
-            s1 = self.new_state()
+            final = { states[q] for q in range(len(states)) if last >> q & 1 }
+            if nullable:
+                final.add(start_state)
+            self.fsm.states.add(start_state)
+            self.fsm.final = final
+        
+        self.stats.count('nfa_states', self.counter - counter)
+        return self.fsm
+    
+    BUILDERS = {
+        'thompson': tree_to_nfa,
+        'glushkov': tree_to_glushkov,
+    }
+    
+    def build(self, builder='thompson'):
+        """The NFA for self.regex, made by the builder named."""
+        if builder not in self.BUILDERS:
+            raise ValueError('Unknown NFA builder: {}'.format(builder))
+        return self.BUILDERS[builder](self)
+    
+    def add_utf8_edges(self, start_state, chars, end_state):
+        """
+        Adds paths from start_state to end_state that read the UTF-8
+        encoding of any character in chars, built back to front so paths
+        with the same tail share its states.
+        """
+        for lo, hi in chars.ranges:
+            for run in utf8.sequences(lo, hi):
+                state = end_state
+                for byte_range in reversed(run[1:]):
+                    key = byte_range + (state,)
+                    if key not in self.suffixes:
+                        self.suffixes[key] = self.new_state()
+                        self.fsm.add_transition(self.suffixes[key], byte_label(*byte_range), state)
+                    state = self.suffixes[key]
+                self.fsm.add_transition(start_state, byte_label(*run[0]), state)
+
+def glushkov_sets(tree):
+    """
+    Positions and their sets for Glushkov's construction: returns (labels,
+    follow, (nullable, first, last)), where labels[p] is position p's
+    character or CharSet, follow[p] is the mask of positions that can come
+    right after p, and the triple is the whole tree's.
+    """
+    labels = []
+    follow = []
+    
+    # (node, children done), and the triples of the finished subtrees
+    todo = [(tree, False)]
+    done = []
+    while todo:
+        node, ready = todo.pop()
+        kind = type(node)
+        
+        if kind is rep.Primitive or kind is rep.CharClass:
+            bit = 1 << len(labels)
+            labels.append(node.c if kind is rep.Primitive else node.chars)
+            follow.append(0)
+            done.append((False, bit, bit))
+            
+        elif ready and kind is rep.Star:
+            nullable, first, last = done.pop()
+            for p in _positions(last):
+                follow[p] |= first
+            done.append((True, first, last))
             
-            # first fragment
-            self.tree_to_nfa(tree.a, start_state, s1)
+        elif ready and kind is rep.Concat:
+            b = done.pop()
+            a = done.pop()
+            for p in _positions(a[2]):
+                follow[p] |= b[1]
+            done.append((
+                a[0] and b[0],
+                a[1] | b[1] if a[0] else a[1],
+                a[2] | b[2] if b[0] else b[2],
+            ))
             
-            # second fragment
-            self.tree_to_nfa(tree.b, s1, end_state)
+        elif ready and kind is rep.Or:
+            b = done.pop()
+            a = done.pop()
+            done.append((a[0] or b[0], a[1] | b[1], a[2] | b[2]))
             
-        elif type(tree) is rep.Or:
-            s1 = self.new_state()
-            s2 = self.new_state()
+        elif kind is rep.Star:
+            todo.append((node, True))
+            todo.append((node.a, False))
             
-            # first branch
-            self.fsm.add_transition(start_state, None, s1)
-            self.tree_to_nfa(tree.a, s1, end_state)
+        elif kind is rep.Concat or kind is rep.Or:
+            todo.append((node, True))
+            todo.append((node.b, False))
+            todo.append((node.a, False))
             
-            # second branch
-            self.fsm.add_transition(start_state, None, s2)
-            self.tree_to_nfa(tree.b, s2, end_state)
+        else:
+            # the empty regex: nullable, no positions
+            done.append((True, 0, 0))
+    
+    return labels, follow, done.pop()
+
+def _positions(mask):
+    while mask:
+        low = mask & -mask
+        mask ^= low
+        yield low.bit_length() - 1
+
+def _is_wide(label):
+    """whether a label has characters outside ASCII"""
+    if type(label) is rep.CharSet:
+        return label.ranges[-1][1] > 0x7F
+    return ord(label) > 0x7F
+
+def byte_label(lo, hi):
+    """edge label for the bytes lo..hi"""
+    if lo == hi:
+        return chr(lo)
+    return rep.CharSet([(lo, hi)])
+
+def thompson_size(tree):
+    """
+    (new states, edges) that Thompson's construction needs for tree, not
+    counting the fragment's own start and end.
+    """
+    nstates = 0
+    nedges = 0
+    todo = [tree]
+    while todo:
+        node = todo.pop()
+        kind = type(node)
+        if kind is rep.Primitive or kind is rep.CharClass:
+            nedges += 1
+        elif kind is rep.Star:
+            nstates += 1
+            nedges += 2
+            todo.append(node.a)
+        elif kind is rep.Concat:
+            nstates += 1
+            todo.append(node.a)
+            todo.append(node.b)
+        elif kind is rep.Or:
+            nstates += 2
+            nedges += 2
+            todo.append(node.a)
+            todo.append(node.b)
+        else:
+            nedges += 1
+    return nstates, nedges
+            
+class ClosureTable(object):
+    """
+    ε-closures of every NFA state as integer bitsets, computed in one pass.
+    
+    Bit i stands for states[i]. The ε-graph is condensed into strongly
+    connected components (Star loops), which Tarjan's algorithm finishes in
+    reverse topological order, so each closure is its component's bits OR
+    the closures of the components it reaches.
+    """
+    def __init__(self, nfa):
+        self.nfa = nfa
+        self.calls = 0
+        self.states = sorted(nfa.get_states() | {nfa.start} | set(nfa.final))
+        self.bit = { s: 1 << i for i, s in enumerate(self.states) }
+        self.final = self.mask(nfa.final)
         
-        return self.fsm
+        # tags format: { bit: tag }, for tagged final states
+        self.tags = { self.bit[s]: tag for s, tag in nfa.tags.items() }
+        
+        # closures format: { bit: mask }
+        self.closures = self._closures()
+        
+        # the NFA's labels split into classes no label tells apart, so
+        # each class moves as one symbol; see partition
+        self.classes, members = partition(nfa.get_alphabet())
+        
+        # steps format: { bit: { class: closure of targets } }
+        self.steps = {}
+        for s in self.states:
+            steps = col.defaultdict(int)
+            for c, t in self.nfa.edges(s):
+                if c is not None:
+                    closure = self.closures[self.bit[t]]
+                    for representative in members[c]:
+                        steps[representative] |= closure
+            self.steps[self.bit[s]] = dict(steps)
+    
+    def mask(self, states):
+        mask = 0
+        for s in states:
+            mask |= self.bit[s]
+        return mask
+    
+    def bits(self, mask):
+        """yields each set bit of mask as an int of its own"""
+        while mask:
+            low = mask & -mask
+            yield low
+            mask ^= low
+    
+    def decode(self, mask):
+        return { self.states[low.bit_length() - 1] for low in self.bits(mask) }
+    
+    def tag(self, mask):
+        """the highest-priority (lowest) tag among mask's final states"""
+        tags = [self.tags[low] for low in self.bits(mask & self.final) if low in self.tags]
+        return min(tags) if tags else None
+    
+    def closure(self, mask):
+        self.calls += 1
+        result = 0
+        for low in self.bits(mask):
+            result |= self.closures[low]
+        return result
+    
+    def _closures(self):
+        eps = { s: list(self.nfa.move(s, None)) for s in self.states }
+        
+        # ε-free, like Glushkov automata: every state closes over itself
+        if not any(eps.values()):
+            return { b: b for b in self.bit.values() }
+        
+        # iterative Tarjan, so deep ε-chains don't hit the recursion limit
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        closures = {}
+        
+        for root in self.states:
+            if root in index:
+                continue
             
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(eps[root]))]
+            
+            while work:
+                s, successors = work[-1]
+                for t in successors:
+                    if t not in index:
+                        index[t] = low[t] = len(index)
+                        stack.append(t)
+                        on_stack.add(t)
+                        work.append((t, iter(eps[t])))
+                        break
+                    elif t in on_stack:
+                        low[s] = min(low[s], index[t])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[s])
+                    
+                    if low[s] == index[s]:
+                        # s roots a component; whatever it reaches outside
+                        # the component is already finished
+                        members = []
+                        while True:
+                            t = stack.pop()
+                            on_stack.discard(t)
+                            members.append(t)
+                            if t == s:
+                                break
+                        
+                        mask = self.mask(members)
+                        for t in members:
+                            for u in eps[t]:
+                                mask |= closures.get(u, 0)
+                        for t in members:
+                            closures[t] = mask
+        
+        return { self.bit[s]: closures[s] for s in self.states }
+
 class NFADFAConverter(object):
-    def __init__(self, nfa):
+    def __init__(self, nfa, minimizer='hopcroft', stats=None):
         self.nfa = nfa
-        self.dfa = FSM()
+        self.stats = NO_STATS if stats is None else stats
+        with self.stats.stage('closures'):
+            self.closures = ClosureTable(nfa)
+        self.dfa = IndexedFSM()
         self.counter = 0
+        self.rounds = 0  # partition refinement rounds, set by the minimizer
+        
+        if minimizer not in self.MINIMIZERS:
+            raise ValueError('Unknown minimizer: {}'.format(minimizer))
+        self.minimizer = minimizer
             
     def next_state(self):
         state = self.counter
@@ -201,56 +842,122 @@ class NFADFAConverter(object):
         return state
 
     def nfa_to_dfa(self):
-        # self.counter = 0
-        alphabet = self.nfa.get_alphabet()
+        stats = self.stats
+        with stats.stage('subset'):
+            self.determinize()
+        stats.count('dfa_states', len(self.dfa.get_states() | {self.dfa.start}))
+        stats.count('closure_calls', self.closures.calls)
+        
+        with stats.stage('minimize'):
+            self.minimize_dfa()
+        stats.count('min_dfa_states', len(self.dfa.get_states() | {self.dfa.start}))
+        stats.count('refinement_rounds', self.rounds)
+        return self.dfa
+    
+    def determinize(self):
+        """
+        Subset construction into self.dfa, without minimizing it.
+        """
+        table = self.closures
         
-        # worklist algorithm
-        dfa_states = [self.ep_closure({self.nfa.start})]
+        # worklist algorithm; subsets are closure bitsets, so finding a known
+        # one is a dict lookup and the closure of a move is an OR
+        dfa_states = [table.closure(table.bit[self.nfa.start])]
+        index = { dfa_states[0]: 0 }
         self.dfa.first = 0
+        self.dfa.classes = table.classes
         
         i = 0
         while i < len(dfa_states):
-            s_i = dfa_states[i]
-            for c in alphabet:
-                s_j = set()
-                for nfa_state in s_i:
-                    s_j.update(self.ep_closure(self.nfa.move(nfa_state, c)))
-                if len(s_j) > 0:
-                    if s_j not in dfa_states:
-                        dfa_states.append(s_j)
-                    to_state = dfa_states.index(s_j)
-                    self.dfa.add_transition(i, c, to_state)
+            moves = col.defaultdict(int)
+            for low in table.bits(dfa_states[i]):
+                for c, mask in table.steps[low].items():
+                    moves[c] |= mask
+            
+            for c, s_j in moves.items():
+                to_state = index.get(s_j)
+                if to_state is None:
+                    to_state = index[s_j] = len(dfa_states)
+                    dfa_states.append(s_j)
+                self.dfa.add_transition(i, c, to_state)
             i += 1
         
         self.dfa.final = { 
-            dfa_states.index(s) 
-            for s in dfa_states 
-            if not s.isdisjoint(self.nfa.final) 
+            i 
+            for i, s in enumerate(dfa_states) 
+            if s & table.final
         }
-
-        self.minimize_dfa()
-
+        if table.tags:
+            for i in self.dfa.final:
+                tag = table.tag(dfa_states[i])
+                if tag is not None:
+                    self.dfa.tags[i] = tag
+        
         return self.dfa
     
     def minimize_dfa(self):
         """
-        Uses a worklist algorithm to minimize DFA.
+        Minimizes the DFA with the engine named by self.minimizer.
         """
             
-        # self.counter = 0
+        # [ ( { state, ... }, [ (c, group), ... ] ) ]
+        groups = self.MINIMIZERS[self.minimizer](self)
+        
+        # final minimized DFA
         min_dfa = FSM()
+        min_dfa.classes = self.dfa.classes
+        for grouped_state in range(len(groups)):
+            for transition in groups[grouped_state][1]:
+                min_dfa.add_transition(grouped_state, *transition)
+            
+            # if new state contains previous start state, it is new start state
+            if self.dfa.start in groups[grouped_state][0]:
+                min_dfa.start = grouped_state
+            
+            # ditto for final states
+            if not self.dfa.final.isdisjoint(groups[grouped_state][0]):
+                min_dfa.final.add(grouped_state)
+            
+            # states only share a group with states of the same tag
+            s = next(iter(groups[grouped_state][0]))
+            if s in self.dfa.tags:
+                min_dfa.tags[grouped_state] = self.dfa.tags[s]
         
+        # renumber canonically, so every engine gives the same machine
+        min_dfa.prettify()
+        
+        self.dfa = min_dfa
+    
+    def _initial_blocks(self, states):
+        """
+        Final states, split by tag, then the rest. Empty blocks are left out.
+        """
+        by_tag = col.defaultdict(set)
+        for s in self.dfa.final & states:
+            by_tag[self.dfa.tags.get(s)].add(s)
+        
+        blocks = [by_tag[tag] for tag in sorted(by_tag, key=lambda t: (t is not None, t))]
+        if states - self.dfa.final:
+            blocks.append(states - self.dfa.final)
+        return blocks
+    
+    def _worklist_groups(self):
+        """
+        Uses a worklist algorithm to partition the DFA states, starting over
+        after every split.
+        """
+            
         alphabet = self.dfa.get_alphabet()
+        states = self.dfa.get_states() | {self.dfa.start}
         
         # [ ( { state, ... },  ) ]
-        groups = [
-            (self.dfa.final, []), 
-            (self.dfa.get_states() - self.dfa.final, [])
-        ]
+        groups = [(block, []) for block in self._initial_blocks(states)]
         # print(groups)
         
+        self.rounds = 0
         i = 0
         while i < len(groups):
+            self.rounds += 1
             # print('groups', groups)
             
             # group_table format: { from_state: [ (c, to_state), ... ], ... }
@@ -289,54 +996,112 @@ class NFADFAConverter(object):
             # pprint.pprint(groups)
 
         # print('final groups', groups)
+        return groups
+    
+    def _hopcroft_groups(self):
+        """
+        Hopcroft's partition refinement, O(n·|Σ|·log n).
         
-        # final minimized DFA
-        min_dfa = FSM()
-        for grouped_state in range(len(groups)):
-            for transition in groups[grouped_state][1]:
-                min_dfa.add_transition(grouped_state, *transition)
+        Missing transitions go to a sink state that starts out in a block of
+        its own, so "no transition" never merges with a real state, just as
+        in the worklist routine.
+        """
+        
+        alphabet = sorted(self.dfa.get_alphabet())
+        states = self.dfa.get_states() | {self.dfa.start}
+        sink = object()
+        
+        # inverse format: { c: { to_state: [from_state, ...] } }
+        inverse = {c: col.defaultdict(list) for c in alphabet}
+        for s in states:
+            for c in alphabet:
+                targets = self.dfa.move(s, c)
+                inverse[c][targets.pop() if targets else sink].append(s)
+        for c in alphabet:
+            inverse[c][sink].append(sink)
+        
+        blocks = self._initial_blocks(states) + [{sink}]
+        block_of = {s: i for i, b in enumerate(blocks) for s in b}
+        
+        # splitters are (block, symbol); all initial blocks but one will do
+        largest = max(range(len(blocks)), key=lambda i: len(blocks[i]))
+        worklist = [
+            (i, c) 
+            for i in range(len(blocks)) if i != largest 
+            for c in alphabet
+        ]
+        pending = set(worklist)
+        
+        self.rounds = 0
+        while worklist:
+            self.rounds += 1
+            splitter = worklist.pop()
+            pending.discard(splitter)
+            i, c = splitter
             
-            # if new state contains previous start state, it is new start state
-            if self.dfa.start in groups[grouped_state][0]:
-                min_dfa.start = grouped_state
+            # states with a c-transition into the splitter, grouped by block
+            touched = col.defaultdict(set)
+            for t in blocks[i]:
+                for s in inverse[c].get(t, ()):
+                    touched[block_of[s]].add(s)
             
-            # ditto for final states
-            if not self.dfa.final.isdisjoint(groups[grouped_state][0]):
-                min_dfa.final.add(grouped_state)
+            for j, inside in touched.items():
+                if len(inside) == len(blocks[j]):
+                    continue
+                
+                # the smaller half moves to a new block
+                if 2 * len(inside) <= len(blocks[j]):
+                    moved = inside
+                    blocks[j] -= inside
+                else:
+                    moved = blocks[j] - inside
+                    blocks[j] = inside
+                
+                k = len(blocks)
+                blocks.append(moved)
+                for s in moved:
+                    block_of[s] = k
+                
+                # (j, d) pending or not, (k, d) is the right splitter to add
+                for d in alphabet:
+                    if (k, d) not in pending:
+                        pending.add((k, d))
+                        worklist.append((k, d))
         
-        print('before prettify\n', min_dfa)
+        blocks = [b for b in blocks if sink not in b]
+        index = {s: g for g, b in enumerate(blocks) for s in b}
         
-        # make 0 the start node just to look nice
-        min_dfa.prettify()
+        groups = []
+        for b in blocks:
+            # any member will do, they all agree
+            s = next(iter(b))
+            transitions = []
+            for c in alphabet:
+                targets = self.dfa.move(s, c)
+                if targets:
+                    transitions.append((c, index[targets.pop()]))
+            groups.append((b, transitions))
         
-        self.dfa = min_dfa
+        return groups
+    
+    MINIMIZERS = {
+        'hopcroft': _hopcroft_groups,
+        'worklist': _worklist_groups,
+    }
 
     def ep_closure(self, states):
-        # worklist algorithm - track by converting set to dict
-        statedict = dict.fromkeys(states)
-
-        while None in statedict.values():
-            # find one we haven't touched yet
-            for s in statedict:
-                if statedict[s] is None:
-                    break
-
-            new_states = self.nfa.move(s, None)
-            for s_new in new_states:
-                statedict.setdefault(s_new)
-            statedict[s] = True
-            
-        return set(statedict.keys())
+        table = self.closures
+        return table.decode(table.closure(table.mask(states)))
 
 
-def regex_to_nfa(regex):
-    converter = RegexNFAConverter(regex)    
-    nfa = converter.tree_to_nfa()
-    return nfa
+def regex_to_nfa(regex, stats=None, builder='thompson'):
+    converter = RegexNFAConverter(regex, stats=stats)
+    nfa = converter.build(builder)
+    return nfa.to_fsm()
 
-def regex_to_dfa(regex):
-    nfa = regex_to_nfa(regex)
-    converter = NFADFAConverter(nfa)
+def regex_to_dfa(regex, minimizer='hopcroft', stats=None, builder='thompson'):
+    nfa = RegexNFAConverter(regex, stats=stats).build(builder)
+    converter = NFADFAConverter(nfa, minimizer, stats)
     return converter.nfa_to_dfa()
 
 def main():
@@ -0,0 +1,101 @@
+# -*- coding: UTF-8 -*-
+"""
+Opt-in instrumentation for the compile pipeline.
+
+The converters take stats=CompileStats() and then time each stage they run
+and count what they build. Without one, nothing is measured or printed.
+"""
+
+import collections as col
+import time
+import tracemalloc
+
+class CompileStats(object):
+    """
+    Timings and counts from one or more compiles, added up.
+
+    seconds and peak_memory are by stage: parse, simplify, thompson (or
+    glushkov), closures, subset and minimize. counts has nfa_states, dfa_states,
+    min_dfa_states, closure_calls and refinement_rounds. Peak memory is
+    only measured with trace_memory, as tracemalloc slows down everything
+    it watches.
+    callback(stage, seconds, stats) is called as each stage ends, to pass
+    the numbers on to a metrics system.
+    """
+    def __init__(self, trace_memory=False, callback=None):
+        self.trace_memory = trace_memory
+        self.callback = callback
+
+        # seconds format: { stage: seconds }
+        self.seconds = col.defaultdict(float)
+        # peak_memory format: { stage: bytes }
+        self.peak_memory = {}
+        self.counts = col.Counter()
+
+    def stage(self, name):
+        """Context manager that times (and traces) the stage name."""
+        return _Stage(self, name)
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def as_dict(self):
+        """The stats as one flat dict of numbers, for exporting."""
+        flat = {}
+        for stage, seconds in self.seconds.items():
+            flat['{}_seconds'.format(stage)] = seconds
+        for stage, peak in self.peak_memory.items():
+            flat['{}_peak_bytes'.format(stage)] = peak
+        flat.update(self.counts)
+        return flat
+
+    def __repr__(self):
+        return 'CompileStats({})'.format(self.as_dict())
+
+class _Stage(object):
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.tracing = False
+
+    def __enter__(self):
+        if self.stats.trace_memory:
+            # an outer stage may be tracing already
+            self.tracing = not tracemalloc.is_tracing()
+            if self.tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.begin
+        stats = self.stats
+        stats.seconds[self.name] += seconds
+
+        if stats.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            if self.tracing:
+                tracemalloc.stop()
+            stats.peak_memory[self.name] = max(peak, stats.peak_memory.get(self.name, 0))
+
+        if stats.callback is not None:
+            stats.callback(self.name, seconds, stats)
+
+class _NoStats(object):
+    """Stands in for CompileStats when nobody asked for any."""
+    def stage(self, name):
+        return _NO_STAGE
+
+    def count(self, name, n=1):
+        pass
+
+class _NoStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_STAGE = _NoStage()
+NO_STATS = _NoStats()
@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+
+import collections as col
+from array import array
+
+import fsm
+import bitnfa
+from dfa import CompiledDFA, as_bytes
+
+CacheInfo = col.namedtuple('CacheInfo', 'hits misses flushes states max_states')
+
+# -2 marks a transition that hasn't been worked out yet
+UNKNOWN = -2
+
+class LazyDFA(CompiledDFA):
+    """
+    A DFA built from the NFA one transition at a time, as matching first
+    needs it, in the style of RE2.
+
+    DFA states are NFA state bitmasks interned in a cache. Once the cache
+    holds max_states states (or max_memory bytes of table) it is flushed and
+    rebuilt from whatever the matcher reaches next.
+    """
+    def __init__(self, nfa, max_states=None, max_memory=None):
+        closures = fsm.ClosureTable(nfa)
+        self.start_mask = closures.closure(closures.bit[nfa.start])
+        self.final_mask = closures.final
+        self.has, self.moves = bitnfa.byte_moves(closures)
+
+        if max_states is None:
+            max_states = 10000
+        if max_memory is not None:
+            # a table row and its finals flag
+            row_size = 256 * array('i').itemsize + 1
+            max_states = min(max_states, max_memory // row_size)
+        if max_states < 2:
+            raise ValueError('The cache needs room for at least 2 states')
+        self.max_states = max_states
+        self.prefilter = None
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self._reset()
+
+    @property
+    def start(self):
+        return self._state(self.start_mask)
+
+    @property
+    def nstates(self):
+        return len(self.sets)
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.flushes, len(self.sets), self.max_states)
+
+    def fullmatch(self, data, pos=0, endpos=None):
+        data = as_bytes(data)
+        if endpos is None:
+            endpos = len(data)
+
+        # the longest match reaches endpos if any match does
+        return self._match(data, pos, endpos) == endpos
+
+    def _match(self, data, pos, endpos):
+        state = self.start
+        table = self.table
+        finals = self.finals
+        last = pos if finals[state] else None
+        misses = self.misses
+
+        i = pos
+        while i < endpos:
+            b = data[i]
+            t = table[(state << 8) | b]
+            if t == UNKNOWN:
+                t = self._fill(state, b)
+
+                # a flush replaces the table
+                table = self.table
+                finals = self.finals
+            if t < 0:
+                break
+
+            state = t
+            i += 1
+            if finals[t]:
+                last = i
+
+        lookups = i - pos + (1 if i < endpos else 0)
+        self.hits += lookups - (self.misses - misses)
+        return last
+
+    def _fill(self, state, b):
+        self.misses += 1
+
+        m = self.sets[state] & self.has[b]
+        step = self.moves[b]
+        mask = 0
+        while m:
+            low = m & -m
+            mask |= step[low]
+            m ^= low
+
+        if not mask:
+            t = -1
+        else:
+            t = self.index.get(mask)
+            if t is None:
+                if len(self.sets) >= self.max_states:
+                    # state's row is gone too, so there's nothing to record
+                    self._flush()
+                    return self._state(mask)
+                t = self._state(mask)
+
+        self.table[(state << 8) | b] = t
+        return t
+
+    def _state(self, mask):
+        t = self.index.get(mask)
+        if t is None:
+            t = self.index[mask] = len(self.sets)
+            self.sets.append(mask)
+            self.table.extend(array('i', [UNKNOWN]) * 256)
+            self.finals.append(1 if mask & self.final_mask else 0)
+        return t
+
+    def _reset(self):
+        # sets format:  [ mask, ... ], by DFA state
+        # index format: { mask: state }
+        self.sets = []
+        self.index = {}
+        self.table = array('i')
+        self.finals = bytearray()
+
+    def _flush(self):
+        self.flushes += 1
+        self._reset()
+
+    def __repr__(self):
+        return 'LazyDFA(<{} of {} states>)'.format(len(self.sets), self.max_states)
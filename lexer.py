@@ -0,0 +1,87 @@
+# -*- coding: UTF-8 -*-
+
+import fsm
+import dfa
+from dfa import as_bytes
+
+class LexError(ValueError):
+    def __init__(self, pos):
+        super(LexError, self).__init__('No token matches at offset {}'.format(pos))
+        self.pos = pos
+
+def rules_to_nfa(regexes):
+    """
+    Builds every regex into one NFA under a shared start state. The final
+    state of regexes[i] is tagged i.
+    """
+    converter = fsm.RegexNFAConverter()
+    start = converter.new_state()
+
+    tags = {}
+    for tag, regex in enumerate(regexes):
+        # each rule gets its own start, so a top-level Star can't loop back
+        # into the other rules
+        rule_start = converter.new_state()
+        rule_end = converter.new_state()
+        converter.fsm.add_transition(start, None, rule_start)
+        converter.tree_to_nfa(converter.regex_to_tree(regex), rule_start, rule_end)
+        tags[rule_end] = tag
+
+    nfa = converter.fsm
+    nfa.start = start
+    nfa.final = set(tags)
+    nfa.tags = tags
+    return nfa
+
+class Lexer(object):
+    """
+    Maximal-munch tokenizer over one DFA for all of its rules.
+
+    rules is a list of (name, regex); when several rules match the longest
+    token, the earliest one wins. Tokens whose name is in skip are matched
+    but not yielded.
+    """
+    def __init__(self, rules, skip=()):
+        self.names = [name for name, _ in rules]
+        self.skip = set(skip)
+
+        nfa = rules_to_nfa([regex for _, regex in rules])
+        self.dfa = fsm.NFADFAConverter(nfa).nfa_to_dfa()
+        self.compiled = dfa.compile(self.dfa)
+
+        if self.compiled.finals[self.compiled.start]:
+            tag = self.compiled.tags[self.compiled.start]
+            raise ValueError('Rule {} matches the empty string'.format(self.names[tag]))
+
+    def tokens(self, data, pos=0):
+        """
+        Yields (name, start, end) for each token, raising LexError where
+        no rule matches.
+        """
+        data = as_bytes(data)
+        table = self.compiled.table
+        classes = self.compiled.classes
+        ncols = self.compiled.ncols
+        tags = self.compiled.tags
+        start = self.compiled.start
+        names = self.names
+        skip = self.skip
+        endpos = len(data)
+
+        while pos < endpos:
+            state = start
+            last = None
+            for i in range(pos, endpos):
+                state = table[state * ncols + classes[data[i]]]
+                if state < 0:
+                    break
+                if tags[state] >= 0:
+                    last = i + 1
+                    tag = tags[state]
+
+            if last is None:
+                raise LexError(pos)
+
+            if names[tag] not in skip:
+                yield names[tag], pos, last
+            pos = last
@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+"""
+Literals every match of a regex must contain, found from its parse tree.
+
+Matches are UTF-8 bytes, as the automata read them. For each node the
+analysis works out whether it matches the empty string, the few exact
+strings it matches (if it only matches a few), literals one of which every
+match starts or ends with, one literal every match contains, and the bytes
+a match can start with. A Prefilter uses them to jump with bytes.find to
+the places a match could start, so the DFA only runs there.
+"""
+
+import collections as col
+
+import reparse as rep
+import utf8
+
+# more alternatives than this and a set of literals is not worth searching
+LIMIT = 16
+
+# first bytes searched for one at a time, when there's no better literal
+FIRST_BYTES = 3
+
+Info = col.namedtuple('Info', 'nullable exact prefixes suffixes inner first')
+Info.__doc__ = """
+nullable    matches the empty string
+exact       frozenset of every string it matches, or None if too many
+prefixes    frozenset, every match starts with one of them; b'' if unknown
+suffixes    the same for the ends of matches
+inner       bytes every match contains, possibly b''
+first       frozenset of the bytes a non-empty match can start with
+"""
+
+NOTHING = frozenset([b''])
+
+def _literal(strings):
+    """Info for a node matching exactly strings."""
+    strings = frozenset(strings)
+    inner = _longest(_common(strings), _common_suffix(strings))
+    return Info(b'' in strings, strings if len(strings) <= LIMIT else None,
+                _limit(strings, _common), _limit(strings, _common_suffix),
+                inner, frozenset(s[0] for s in strings if s))
+
+def _common(strings):
+    strings = list(strings)
+    first = min(strings)
+    last = max(strings)
+    n = 0
+    while n < len(first) and first[n] == last[n]:
+        n += 1
+    return first[:n]
+
+def _common_suffix(strings):
+    return _common(s[::-1] for s in strings)[::-1]
+
+def _limit(strings, common):
+    """strings, or their common part once there are too many to search"""
+    if len(strings) <= LIMIT and b'' not in strings:
+        return frozenset(strings)
+    return frozenset([common(strings)])
+
+def _cross(a, b):
+    if len(a) * len(b) > LIMIT:
+        return None
+    return frozenset(x + y for x in a for y in b)
+
+def _longest(*literals):
+    return max(literals, key=len)
+
+def _single(strings):
+    if len(strings) == 1:
+        return next(iter(strings))
+    return b''
+
+def char_class(chars):
+    """Info for a CharClass."""
+    if len(chars) <= LIMIT:
+        return _literal(utf8.encode(c) for lo, hi in chars.ranges for c in range(lo, hi + 1)
+                        if not utf8.SURROGATES[0] <= c <= utf8.SURROGATES[1])
+
+    first = set()
+    for lo, hi in chars.ranges:
+        for run in utf8.sequences(lo, hi):
+            first.update(range(run[0][0], run[0][1] + 1))
+    return Info(False, None, NOTHING, NOTHING, b'', frozenset(first))
+
+def concat(a, b):
+    exact = _cross(a.exact, b.exact) if a.exact is not None and b.exact is not None else None
+
+    prefixes = a.prefixes
+    if a.exact is not None:
+        prefixes = _cross(a.exact, b.prefixes) or _limit(a.exact, _common)
+
+    suffixes = b.suffixes
+    if b.exact is not None:
+        suffixes = _cross(a.suffixes, b.exact) or _limit(b.exact, _common_suffix)
+
+    inner = _longest(a.inner, b.inner, _single(a.suffixes) + _single(b.prefixes),
+                     _single(prefixes), _single(suffixes))
+
+    first = a.first | b.first if a.nullable else a.first
+    if exact is not None:
+        return _literal(exact)
+    return Info(a.nullable and b.nullable, None, prefixes, suffixes, inner, first)
+
+def alternate(a, b):
+    if a.exact is not None and b.exact is not None:
+        return _literal(a.exact | b.exact)
+
+    prefixes = _limit(a.prefixes | b.prefixes, _common)
+    suffixes = _limit(a.suffixes | b.suffixes, _common_suffix)
+    inner = a.inner if a.inner == b.inner else _longest(_single(prefixes), _single(suffixes))
+    return Info(a.nullable or b.nullable, None, prefixes, suffixes, inner, a.first | b.first)
+
+def star(a):
+    if a.exact == NOTHING:
+        return a
+    return Info(True, None, NOTHING, NOTHING, b'', a.first)
+
+def analyze(tree):
+    """
+    Info for a whole parse tree, worked out bottom up with an explicit
+    stack, as trees can be deep. Subtrees that appear more than once (they
+    are interned, so they're the same node) are worked out once.
+    """
+    infos = {}
+    # (node, children done)
+    todo = [(tree, False)]
+    done = []
+    while todo:
+        node, ready = todo.pop()
+        kind = type(node)
+
+        if not ready and node in infos:
+            done.append(infos[node])
+            continue
+
+        if kind is rep.Primitive:
+            info = _literal([node.c.encode('utf-8')])
+        elif kind is rep.CharClass:
+            info = char_class(node.chars)
+        elif ready and kind is rep.Star:
+            info = star(done.pop())
+        elif ready:
+            b = done.pop()
+            a = done.pop()
+            info = concat(a, b) if kind is rep.Concat else alternate(a, b)
+        elif kind is rep.Star:
+            todo.append((node, True))
+            todo.append((node.a, False))
+            continue
+        elif kind is rep.Concat or kind is rep.Or:
+            todo.append((node, True))
+            todo.append((node.b, False))
+            todo.append((node.a, False))
+            continue
+        else:
+            info = _literal([b''])
+
+        infos[node] = info
+        done.append(info)
+
+    return done.pop()
+
+class Prefilter(object):
+    """
+    Finds the positions a match might start at, skipping the rest.
+
+    Every match starts at an occurrence of one of the prefixes (or of one
+    of a few first bytes), or failing that on a byte in first. No match
+    starts after the last occurrence of the required literal.
+    """
+    def __init__(self, info):
+        self.prefixes = None
+        if b'' not in info.prefixes:
+            self.prefixes = sorted(info.prefixes)
+        elif len(info.first) <= FIRST_BYTES:
+            self.prefixes = [bytes([b]) for b in sorted(info.first)]
+
+        self.required = info.inner or None
+
+        self.first = None
+        if self.prefixes is None and len(info.first) < 256:
+            self.first = bytearray(256)
+            for b in info.first:
+                self.first[b] = 1
+
+    def candidates(self, data, pos, endpos):
+        """Yields the start positions in [pos, endpos] to try, in order."""
+        prefixes = self.prefixes
+        required = self.required
+        first = self.first
+
+        # the next occurrence of each prefix, found again once passed
+        if prefixes is not None:
+            found = [data.find(p, pos, endpos) for p in prefixes]
+
+        i = -1
+        start = pos
+        while start < endpos:
+            if prefixes is not None:
+                start = min((j for j in found if j >= 0), default=-1)
+                if start < 0:
+                    return
+                for k, j in enumerate(found):
+                    if j == start:
+                        found[k] = data.find(prefixes[k], start + 1, endpos)
+
+            if required is not None and start > i:
+                i = data.find(required, start, endpos)
+                if i < 0:
+                    return
+
+            if first is None or first[data[start]]:
+                yield start
+            start += 1
+
+def prefilter(tree):
+    """
+    A Prefilter for the regex tree, or None if it can't rule anything out,
+    as when the regex matches the empty string.
+    """
+    info = analyze(tree)
+    if info.nullable:
+        return None
+
+    prefilter = Prefilter(info)
+    if prefilter.prefixes is None and prefilter.required is None and prefilter.first is None:
+        return None
+    return prefilter
@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+
+import collections as col
+import weakref
+
+import fsm
+import reparse as rep
+import bitnfa
+import lazydfa
+import literals
+import derivative
+
+CacheInfo = col.namedtuple('CacheInfo', 'hits misses evictions shared size maxsize')
+
+class PatternCache(object):
+    """
+    LRU cache of compiled matchers, keyed by pattern, engine and options.
+    
+    Behind it, compiled DFAs are also kept by the fingerprint of their
+    minimized DFA, so different spellings of one language (a|b, b|a) share
+    a single table for as long as any cache entry uses it.
+    """
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared = 0
+        
+        self._entries = col.OrderedDict()
+        self._by_fingerprint = weakref.WeakValueDictionary()
+    
+    def get(self, key):
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def share(self, dfa):
+        """
+        Returns the compiled table for a minimized DFA, reusing one that is
+        already alive for the same language.
+        """
+        fingerprint = dfa.fingerprint()
+        compiled = self._by_fingerprint.get(fingerprint)
+        if compiled is None:
+            compiled = self._by_fingerprint[fingerprint] = dfa.compile()
+        else:
+            self.shared += 1
+        return compiled
+    
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.shared,
+                         len(self._entries), self.maxsize)
+
+_cache = PatternCache()
+
+def _compile_dfa(pattern, builder='thompson'):
+    converter = fsm.RegexNFAConverter(pattern)
+    compiled = _cache.share(fsm.NFADFAConverter(converter.build(builder)).nfa_to_dfa())
+    
+    # shared tables get the first pattern's prefilter, which is just as
+    # good for any other spelling of the language
+    if compiled.prefilter is None:
+        compiled.prefilter = literals.prefilter(converter.tree)
+    return compiled
+
+def _compile_derivative(pattern, max_states=None):
+    tree = rep.REParser(pattern).parse()
+    compiled = _cache.share(derivative.Derivatives(tree).to_fsm(max_states))
+    if compiled.prefilter is None:
+        compiled.prefilter = literals.prefilter(tree)
+    return compiled
+
+def _compile_nfa(pattern, builder='thompson'):
+    return bitnfa.BitNFA(fsm.RegexNFAConverter(pattern).build(builder))
+
+def _compile_lazy(pattern, max_states=None, max_memory=None, builder='thompson'):
+    converter = fsm.RegexNFAConverter(pattern)
+    compiled = lazydfa.LazyDFA(converter.build(builder), max_states, max_memory)
+    compiled.prefilter = literals.prefilter(converter.tree)
+    return compiled
+
+# engine name -> pattern -> matcher with match/fullmatch/search/finditer
+ENGINES = {
+    'dfa': _compile_dfa,
+    'nfa': _compile_nfa,
+    'lazy': _compile_lazy,
+    'derivative': _compile_derivative,
+}
+
+def compile(pattern, engine='dfa', **options):
+    """
+    Compiles pattern with the named engine: 'dfa' builds and minimizes a
+    DFA up front, 'nfa' simulates the Thompson NFA and never blows up, and
+    'lazy' builds DFA states as they're reached, within a cache budget
+    (options max_states/max_memory). The dfa, nfa and lazy engines take
+    builder='glushkov' to start from an ε-free position automaton instead
+    of Thompson's NFA. 'derivative' builds the DFA from Brzozowski
+    derivatives, with no NFA and no minimization (option max_states).
+    
+    Results are cached, so compiling the same pattern again is a lookup.
+    """
+    try:
+        build = ENGINES[engine]
+    except KeyError:
+        raise ValueError('Unknown engine: {}'.format(engine))
+    
+    key = (pattern, engine, tuple(sorted(options.items())))
+    compiled = _cache.get(key)
+    if compiled is None:
+        compiled = build(pattern, **options)
+        _cache.put(key, compiled)
+    return compiled
+
+def cache_info():
+    return _cache.info()
+
+def set_cache_size(maxsize):
+    _cache.resize(maxsize)
+
+def purge():
+    _cache.clear()
@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+"""
+Scanning one big file on several cores.
+
+The file is cut into chunks and every chunk is scanned by a worker process
+from every DFA state at once, since only the chunk before it knows which
+state it really starts in. Runs from different states usually land in the
+same state within a few bytes, after which the worker carries on with a
+single run. Each worker returns where each start state ends up, and the
+parent composes those maps in order to pick out the real run.
+"""
+
+import mmap
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import fsm
+import reparse as rep
+
+def search_dfa(pattern):
+    """
+    DFA for pattern anywhere in the input: it is final right after every
+    byte where some match of pattern ends.
+    """
+    converter = fsm.RegexNFAConverter(pattern)
+    nfa = converter.tree_to_nfa()
+
+    start = converter.new_state()
+    nfa.add_transition(start, rep.CharSet([(0, 255)]), start)
+    nfa.add_transition(start, None, nfa.start)
+    nfa.start = start
+
+    return fsm.NFADFAConverter(nfa).nfa_to_dfa().compile()
+
+# the DFA each worker scans with, set up by _init_worker
+_worker_dfa = None
+
+def _init_worker(table, classes, finals, nstates):
+    global _worker_dfa
+    ints = array('i')
+    ints.frombytes(table)
+    _worker_dfa = (ints, classes, len(ints) // max(nstates, 1), finals, nstates)
+
+def _scan_chunk(args):
+    """
+    Scans [begin, end) of the file from every DFA state.
+
+    Returns (mapping, hits, shared, converged): the state each start state
+    ends in (-1 for dead), the match ends each start state saw before the
+    runs converged, the match ends after that, and the start states that
+    converged.
+    """
+    path, begin, end = args
+    table, classes, ncols, finals, nstates = _worker_dfa
+
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        # groups format: { state: [start state, ...] }, live runs only
+        groups = { q: [q] for q in range(nstates) }
+        hits = {}
+        mapping = {}
+
+        i = begin
+        while i < end and len(groups) > 1:
+            b = classes[data[i]]
+            i += 1
+
+            moved = {}
+            for state, origins in groups.items():
+                t = table[state * ncols + b]
+                if t < 0:
+                    for o in origins:
+                        mapping[o] = -1
+                    continue
+
+                if t in moved:
+                    moved[t].extend(origins)
+                else:
+                    moved[t] = list(origins)
+
+                if finals[t]:
+                    for o in origins:
+                        hits.setdefault(o, []).append(i)
+            groups = moved
+
+        shared = []
+        converged = []
+        if len(groups) == 1:
+            (state, converged), = groups.items()
+            while i < end:
+                state = table[state * ncols + classes[data[i]]]
+                i += 1
+                if state < 0:
+                    break
+                if finals[state]:
+                    shared.append(i)
+            groups = { state: converged }
+
+        for state, origins in groups.items():
+            for o in origins:
+                mapping[o] = state
+
+        return mapping, hits, shared, set(converged)
+    finally:
+        data.close()
+
+def _chunks(path, chunk_size):
+    size = os.path.getsize(path)
+    return [(path, begin, min(begin + chunk_size, size))
+            for begin in range(0, size, chunk_size)]
+
+def match_ends(compiled, path, processes=None, chunk_size=64 << 20):
+    """
+    Yields, in order, the offset just past every byte of the file where
+    compiled (see search_dfa) is in a final state, scanning chunks of the
+    file in parallel. processes=1 scans in this process.
+    """
+    table = array('i', compiled.table).tobytes()
+    classes = bytes(compiled.classes)
+    finals = bytes(compiled.finals)
+    nstates = compiled.nstates
+    chunks = _chunks(path, chunk_size)
+
+    if processes == 1:
+        _init_worker(table, classes, finals, nstates)
+        results = map(_scan_chunk, chunks)
+    else:
+        pool = ProcessPoolExecutor(processes, initializer=_init_worker,
+                                   initargs=(table, classes, finals, nstates))
+        results = pool.map(_scan_chunk, chunks)
+
+    try:
+        state = compiled.start
+        for mapping, hits, shared, converged in results:
+            if state < 0:
+                break
+            for end in hits.get(state, ()):
+                yield end
+            if state in converged:
+                for end in shared:
+                    yield end
+            state = mapping[state]
+    finally:
+        if processes != 1:
+            pool.shutdown(cancel_futures=True)
+
+def count(pattern, path, processes=None, chunk_size=64 << 20):
+    """Counts the positions in the file where a match of pattern ends."""
+    compiled = search_dfa(pattern)
+    return sum(1 for _ in match_ends(compiled, path, processes, chunk_size))
@@ -6,14 +6,145 @@
 # 
 # <base> ::= <char>
 #          | '\' <char>
+#          | '.'
+#          | '[' [ '^' ] <item> { <item> } ']'
 #          | '(' <regex> ')'
+# 
+# <item> ::= <classchar> [ '-' <classchar> ]
+# 
+# <classchar> ::= <char>
+#               | '\' <char>
+
+import bisect
+import weakref
+
+MAX_CHAR = 0x10FFFF
+
+class CharSet(object):
+    """
+    Immutable set of characters, kept as sorted, disjoint (lo, hi) code
+    point ranges. Hashable, so it can label NFA edges.
+    """
+    def __init__(self, ranges):
+        merged = []
+        for lo, hi in sorted(ranges):
+            if merged and lo <= merged[-1][1] + 1:
+                if hi > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], hi)
+            else:
+                merged.append((lo, hi))
+        
+        self.ranges = tuple(merged)
+        self._los = [lo for lo, _ in merged]
+        self._hash = hash(self.ranges)
+    
+    @classmethod
+    def of(cls, chars):
+        return cls((ord(c), ord(c)) for c in chars)
+    
+    def negate(self):
+        ranges = []
+        lo = 0
+        for a, b in self.ranges:
+            if a > lo:
+                ranges.append((lo, a - 1))
+            lo = b + 1
+        if lo <= MAX_CHAR:
+            ranges.append((lo, MAX_CHAR))
+        return CharSet(ranges)
+    
+    def __contains__(self, c):
+        if isinstance(c, str):
+            c = ord(c)
+        i = bisect.bisect_right(self._los, c) - 1
+        return i >= 0 and c <= self.ranges[i][1]
+    
+    def __len__(self):
+        return sum(hi - lo + 1 for lo, hi in self.ranges)
+    
+    def __eq__(self, other):
+        return isinstance(other, CharSet) and self.ranges == other.ranges
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        return self._hash
+    
+    def __str__(self):
+        def char(o):
+            c = chr(o)
+            return '\\' + c if c in '\\]^-' else c if c.isprintable() else '\\x{:x}'.format(o)
+        
+        parts = []
+        for lo, hi in self.ranges:
+            if lo == hi:
+                parts.append(char(lo))
+            else:
+                parts.append('{}-{}'.format(char(lo), char(hi)))
+        return '[{}]'.format(''.join(parts))
+    
+    def __repr__(self):
+        return 'CharSet({})'.format(list(self.ranges))
+
+# '.' is anything but a newline
+DOT = CharSet.of('\n').negate()
 
 class RegEx(object):
-    def __init__(self):
-        pass
+    """
+    The empty regex, and the base of the parse tree nodes.
+    
+    Nodes are immutable and interned: making a node equal to one that is
+    still alive gives back that node, so equal subtrees are one object,
+    compare by identity and hash in O(1), and can key memo dicts. The
+    intern table holds nodes weakly, so trees go when nobody uses them.
+    """
+    __slots__ = ('_hash', '_tuple', '__weakref__')
+    _fields = ()
+    
+    # _interned format: { (cls, field, ...): node }
+    _interned = weakref.WeakValueDictionary()
+    
+    def __new__(cls, *fields):
+        key = (cls,) + fields
+        node = RegEx._interned.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            for name, value in zip(cls._fields, fields):
+                object.__setattr__(node, name, value)
+            object.__setattr__(node, '_hash', hash(key))
+            object.__setattr__(node, '_tuple', None)
+            
+            # another thread may have made the same node meanwhile
+            node = RegEx._interned.setdefault(key, node)
+        return node
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('{} nodes are immutable'.format(type(self).__name__))
+    
+    def __delattr__(self, name):
+        raise AttributeError('{} nodes are immutable'.format(type(self).__name__))
+    
+    def __reduce__(self):
+        return type(self), tuple(getattr(self, name) for name in self._fields)
+    
+    def __eq__(self, other):
+        return self is other
+    
+    def __ne__(self, other):
+        return self is not other
+    
+    def __hash__(self):
+        return self._hash
     
     def __iter__(self):
-        return iter(())
+        # the tuple form, built once per node
+        if self._tuple is None:
+            object.__setattr__(self, '_tuple', self._as_tuple())
+        return iter(self._tuple)
+    
+    def _as_tuple(self):
+        return ()
     
     def __str__(self):
         return '\'\''
@@ -22,10 +153,8 @@ class RegEx(object):
         return 'RegEx()'
 
 class Or(RegEx):
-    def __init__(self, a, b):
-        super(Or, self).__init__()
-        self.a = a
-        self.b = b
+    __slots__ = ('a', 'b')
+    _fields = ('a', 'b')
     
     def __str__(self):
         return '(|, {}, {})'.format(self.a, self.b)
@@ -33,17 +162,15 @@ class Or(RegEx):
     def __repr__(self):
         return 'Or({}, {})'.format(self.a, self.b)
     
-    def __iter__(self):
-        return iter(('|', tuple(self.a), tuple(self.b)))
+    def _as_tuple(self):
+        return ('|', tuple(self.a), tuple(self.b))
 
 class Concat(RegEx):
-    def __init__(self, a, b):
-        super(Concat, self).__init__()
-        self.a = a
-        self.b = b
+    __slots__ = ('a', 'b')
+    _fields = ('a', 'b')
     
-    def __iter__(self):
-        return iter(('&', tuple(self.a), tuple(self.b)))
+    def _as_tuple(self):
+        return ('&', tuple(self.a), tuple(self.b))
     
     def __str__(self):
         if self.a is not None and self.b is not None:
@@ -56,23 +183,21 @@ class Concat(RegEx):
             return '\'\''
 
 class Star(RegEx):
-    def __init__(self, a):
-        super(Star, self).__init__()
-        self.a = a
+    __slots__ = ('a',)
+    _fields = ('a',)
     
-    def __iter__(self):
-        return iter(('*', tuple(self.a)))
+    def _as_tuple(self):
+        return ('*', tuple(self.a))
     
     def __str__(self):
         return '(*, {})'.format(self.a)
 
 class Primitive(RegEx):
-    def __init__(self, c):
-        super(Primitive, self).__init__()
-        self.c = c
+    __slots__ = ('c',)
+    _fields = ('c',)
     
-    def __iter__(self):
-        return iter((self.c))
+    def _as_tuple(self):
+        return tuple(self.c)
     
     def __str__(self):
         return repr(self.c)
@@ -80,9 +205,40 @@ class Primitive(RegEx):
     def __repr__(self):
         return 'Primitive({})'.format(self.c)
 
+class CharClass(RegEx):
+    __slots__ = ('chars',)
+    _fields = ('chars',)
+    
+    def _as_tuple(self):
+        return ('[',) + self.chars.ranges
+    
+    def __str__(self):
+        return str(self.chars)
+    
+    def __repr__(self):
+        return 'CharClass({!r})'.format(self.chars)
+
+class ParseError(RuntimeError):
+    def __init__(self, message, pos):
+        super(ParseError, self).__init__('{} at position {}'.format(message, pos))
+        self.pos = pos
+
+def balanced(cls, nodes):
+    """
+    Joins nodes, in order, into a tree of cls nodes of depth log n rather
+    than a chain.
+    """
+    while len(nodes) > 1:
+        paired = [cls(nodes[i], nodes[i + 1]) for i in range(0, len(nodes) - 1, 2)]
+        if len(nodes) % 2:
+            paired.append(nodes[-1])
+        nodes = paired
+    return nodes[0]
+
 class REParser(object):
     def __init__(self, exp=None):
         self._input = exp
+        self._pos = 0
 
     def parse(self, tuples=False):
         tree = self._regex()
@@ -90,18 +246,18 @@ class REParser(object):
         if not tuples:
             return tree
         
-        
+        return tuple(tree)
 
 
     # parsing internals
     def _peek(self):
-        return self._input[0]
+        return self._input[self._pos]
 
     def _eat(self, c):
         if self._peek() == c:
-            self._input = self._input[1:]
+            self._pos += 1
         else:
-            raise RuntimeError('Expected: {}; got: {}'.format(c, self.peek()))
+            raise ParseError('Expected: {}; got: {}'.format(c, self._peek()), self._pos)
     
     def _next(self):
         c = self._peek()
@@ -109,56 +265,115 @@ class REParser(object):
         return c
     
     def _more(self):
-        return len(self._input) > 0
+        return self._pos < len(self._input)
 
 
     # RE term types
     def _regex(self):
-        """returns RegEx"""
-        term = self._term()
-        if self._more() and self._peek() == '|':
-            self._eat('|')
-            regex = self._regex()
-            return Or(term, regex)
-        else:
-            return term
-
-    def _term(self):
-        """returns RegEx"""
-        factor = None
+        """
+        returns RegEx
         
-        while self._more() and self._peek() not in (')', '|'):
-            nextfactor = self._factor()
-            if factor is None:
-                factor = nextfactor
+        One pass over the input with a stack of open groups instead of
+        recursion, so neither long alternations nor deep nesting can hit the
+        recursion limit.
+        """
+        # for each open group: (alternatives, factors, position of its '(')
+        stack = []
+        alternatives = []
+        factors = []
+        
+        while self._more():
+            c = self._peek()
+            if c == '(':
+                stack.append((alternatives, factors, self._pos))
+                self._eat('(')
+                alternatives = []
+                factors = []
+            elif c == ')':
+                if not stack:
+                    raise ParseError("Unbalanced ')'", self._pos)
+                self._eat(')')
+                group = self._alternation(alternatives, factors)
+                alternatives, factors, _ = stack.pop()
+                factors.append(group)
+            elif c == '|':
+                self._eat('|')
+                alternatives.append(self._term(factors))
+                factors = []
+            elif c == '*':
+                self._eat('*')
+                if factors:
+                    factors[-1] = Star(factors[-1])
+                else:
+                    # nothing to repeat, so it's a literal
+                    factors.append(Primitive('*'))
+            elif c == '\\':
+                factors.append(Primitive(self._escapable()))
+            elif c == '.':
+                self._eat('.')
+                factors.append(CharClass(DOT))
+            elif c == '[':
+                factors.append(self._char_class())
             else:
-                factor = Concat(factor, nextfactor)
+                factors.append(Primitive(self._next()))
+        
+        if stack:
+            raise ParseError("Missing ')' for '('", stack[-1][2])
         
-        return factor or RegEx()
+        return self._alternation(alternatives, factors)
 
-    def _factor(self):
-        """returns RegEx"""
-        base = self._base()
+    def _escapable(self):
+        """returns the next character, taking a backslash escape"""
+        if self._peek() == '\\':
+            self._eat('\\')
+            if not self._more():
+                raise ParseError('Nothing to escape', self._pos)
+        return self._next()
+
+    def _char_class(self):
+        """returns CharClass"""
+        start = self._pos
+        self._eat('[')
         
-        while self._more() and self._peek() == '*':
-            self._eat('*')
-            base = Star(base)
+        negate = self._more() and self._peek() == '^'
+        if negate:
+            self._eat('^')
         
-        return base
+        ranges = []
+        first = True
+        while True:
+            if not self._more():
+                raise ParseError("Missing ']' for '['", start)
+            
+            # a ']' straight after the '[' is a literal
+            if self._peek() == ']' and not first:
+                self._eat(']')
+                break
+            first = False
+            
+            lo_pos = self._pos
+            lo = self._escapable()
+            hi = lo
+            if self._pos + 1 < len(self._input) and self._peek() == '-' \
+                    and self._input[self._pos + 1] != ']':
+                self._eat('-')
+                hi = self._escapable()
+                if ord(hi) < ord(lo):
+                    raise ParseError('Bad range {}-{}'.format(lo, hi), lo_pos)
+            ranges.append((ord(lo), ord(hi)))
+        
+        chars = CharSet(ranges)
+        return CharClass(chars.negate() if negate else chars)
 
-    def _base(self):
+    def _alternation(self, alternatives, factors):
         """returns RegEx"""
-        if self._peek() == '(':
-            self._eat('(')
-            r = self._regex()
-            self._eat(')')
-            return r
-        elif self._peek() == '\\':
-            self._eat('\\')
-            esc = self._next()
-            return Primitive(esc)
-        else:
-            return Primitive(self._next())
+        return balanced(Or, alternatives + [self._term(factors)])
+
+    def _term(self, factors):
+        """returns RegEx"""
+        if not factors:
+            return RegEx()
+        return balanced(Concat, factors)
 
 if __name__ == '__main__':
     parser = REParser('(ab)*|cd')
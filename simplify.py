@@ -0,0 +1,230 @@
+# -*- coding: UTF-8 -*-
+"""
+Rewrites a parse tree into a smaller one for the same language.
+
+Concatenations and alternations are handled whole, as lists of factors and
+branches, rather than as the binary trees the parser builds:
+
+    (a*)*       -> a*           () and (|a)* -> a* drop their empty parts
+    a()b        -> ab
+    a|b|a       -> [ab]         duplicates go, single characters merge
+    get|getAll|getter -> get(|All|ter)     common prefixes become a trie
+    getter|setter     -> [gs]etter         and common suffixes are shared
+
+Every construction after this one gets fewer states and edges to build.
+"""
+
+import reparse as rep
+
+EMPTY = rep.RegEx()
+
+def factors(node):
+    """the factors of a concatenation, in order, empty terms left out"""
+    result = []
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        if type(node) is rep.Concat:
+            todo.append(node.b)
+            todo.append(node.a)
+        elif node is not EMPTY:
+            result.append(node)
+    return result
+
+def branches(node):
+    """the branches of an alternation, in order"""
+    result = []
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        if type(node) is rep.Or:
+            todo.append(node.b)
+            todo.append(node.a)
+        else:
+            result.append(node)
+    return result
+
+def concat(parts):
+    parts = [f for part in parts for f in factors(part)]
+    if not parts:
+        return EMPTY
+    return rep.balanced(rep.Concat, parts)
+
+def star(node):
+    # ()* is (), (a*)* is a*, and (|a)* is a*
+    if type(node) is rep.Or:
+        node = alternate([b for b in branches(node) if b is not EMPTY], factor=False)
+    if node is EMPTY or type(node) is rep.Star:
+        return node
+    return rep.Star(node)
+
+def alternate(parts, factor=True):
+    """
+    The alternation of parts: duplicates dropped, single characters merged
+    into one class and, with factor, common prefixes and suffixes shared.
+    """
+    unique = []
+    seen = set()
+    chars = []      # single character branches, merged where the first was
+    slot = None
+    for part in parts:
+        for branch in branches(part):
+            if branch in seen:
+                continue
+            seen.add(branch)
+
+            if type(branch) is rep.Primitive or type(branch) is rep.CharClass:
+                if slot is None:
+                    slot = len(unique)
+                    unique.append(None)
+                chars.append(branch)
+            else:
+                unique.append(branch)
+
+    if chars:
+        unique[slot] = chars[0] if len(chars) == 1 else _merge(chars)
+
+    if factor and len(unique) > 1:
+        unique = _share_suffixes(_prefix_trie(unique))
+    if not unique:
+        return EMPTY
+    if len(unique) == 1:
+        return unique[0]
+    return rep.balanced(rep.Or, unique)
+
+def _merge(chars):
+    """one node for several single character branches"""
+    ranges = []
+    for branch in chars:
+        if type(branch) is rep.Primitive:
+            ranges.extend(rep.CharSet.of(branch.c).ranges)
+        else:
+            ranges.extend(branch.chars.ranges)
+
+    merged = rep.CharSet(ranges)
+    if len(merged) == 1:
+        return rep.Primitive(chr(merged.ranges[0][0]))
+    return rep.CharClass(merged)
+
+def _prefix_trie(alternatives):
+    """
+    The alternatives as a trie on their factors: alternatives starting
+    with the same factor become that factor followed by an alternation of
+    the rest. Returns the top level's alternatives.
+    """
+    # a trie node is [ { factor: child }, ends here ]
+    root = [{}, False]
+    for alternative in alternatives:
+        node = root
+        for f in factors(alternative):
+            children = node[0]
+            if f not in children:
+                children[f] = [{}, False]
+            node = children[f]
+        node[1] = True
+
+    # post-order, so each node's alternatives are built after its children's;
+    # alternatives are factor lists in reverse, so that a long chain of
+    # single children is one append per factor
+    built = {}
+    todo = [(root, False)]
+    while todo:
+        node, ready = todo.pop()
+        if not ready:
+            todo.append((node, True))
+            todo.extend((child, False) for child in node[0].values())
+            continue
+
+        result = []
+        for f, child in node[0].items():
+            rest = built.pop(id(child))
+            if len(rest) == 1:
+                rest = rest[0]
+            else:
+                rest = [alternate(_share_suffixes([concat(fs[::-1]) for fs in rest]), factor=False)]
+            rest.append(f)
+            result.append(rest)
+        if node[1]:
+            result.append([])
+        built[id(node)] = result
+
+    return [concat(fs[::-1]) for fs in built[id(root)]]
+
+def _share_suffixes(alternatives):
+    """
+    Alternatives ending in the same factor become the alternation of what
+    comes before, followed by the longest suffix they all share.
+    """
+    groups = {}
+    order = []
+    for alternative in alternatives:
+        fs = factors(alternative)
+        key = fs[-1] if fs else None
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(fs)
+
+    result = []
+    for key in order:
+        group = groups[key]
+        if key is None or len(group) == 1:
+            result.extend(concat(fs) for fs in group)
+            continue
+
+        n = 1
+        shortest = min(len(fs) for fs in group)
+        while n < shortest and all(fs[-n - 1] is group[0][-n - 1] for fs in group):
+            n += 1
+        heads = [concat(fs[:-n]) for fs in group]
+        result.append(concat([alternate(heads, factor=False)] + group[0][-n:]))
+    return result
+
+def simplify(tree):
+    """
+    The simplified tree, worked out bottom up with an explicit stack. Each
+    distinct subtree is simplified once, as equal subtrees are one node.
+    """
+    done = {}
+    results = []
+    # (node, parts or None before they're done)
+    todo = [(tree, None)]
+    while todo:
+        node, parts = todo.pop()
+        kind = type(node)
+
+        if parts is None and node in done:
+            results.append(done[node])
+            continue
+
+        if parts is None and kind in (rep.Concat, rep.Or, rep.Star):
+            if kind is rep.Concat:
+                parts = factors(node)
+            elif kind is rep.Or:
+                parts = branches(node)
+            else:
+                parts = [node.a]
+            todo.append((node, parts))
+            todo.extend((part, None) for part in reversed(parts))
+            continue
+
+        if kind is rep.Concat:
+            simple = concat(_pop(results, len(parts)))
+        elif kind is rep.Or:
+            simple = alternate(_pop(results, len(parts)))
+        elif kind is rep.Star:
+            simple = star(results.pop())
+        else:
+            simple = node
+
+        done[node] = simple
+        results.append(simple)
+
+    return results.pop()
+
+def _pop(stack, n):
+    if not n:
+        return []
+    popped = stack[-n:]
+    del stack[-n:]
+    return popped
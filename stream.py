@@ -0,0 +1,138 @@
+# -*- coding: UTF-8 -*-
+
+class StreamMatcher(object):
+    """
+    Finds the matches of a CompiledDFA in input that arrives in chunks.
+
+    The spans are the ones CompiledDFA.finditer gives for the whole input
+    at once, in absolute offsets. Every start position still in the running
+    is a thread, and threads that meet in one DFA state are merged keeping
+    the earliest start, so there are never more threads than DFA states.
+    Only the bytes since the current candidate match ends (or the earliest
+    live start) are kept, which a match restart may have to read again.
+    """
+    def __init__(self, compiled):
+        self.compiled = compiled
+
+        self.buffer = bytearray()
+        self.base = 0           # offset of buffer[0]
+        self.pos = 0            # offset of the next byte to scan
+        self.resume = 0         # no match starts before this
+        self.threads = {}       # { state: start }
+        self.candidate = None   # (start, end) of the best match so far
+        self.closed = False
+
+    def feed(self, chunk):
+        """
+        Scans chunk, returning the spans it completed.
+        """
+        if self.closed:
+            raise ValueError('feed() after close()')
+        self.buffer += chunk
+        return self._scan(eof=False)
+
+    def close(self):
+        """
+        Ends the input, returning the spans that were still undecided.
+        """
+        if self.closed:
+            return []
+        self.closed = True
+        return self._scan(eof=True)
+
+    def _scan(self, eof):
+        table = self.compiled.table
+        classes = self.compiled.classes
+        ncols = self.compiled.ncols
+        finals = self.compiled.finals
+        start = self.compiled.start
+
+        buffer = self.buffer
+        base = self.base
+        end = base + len(buffer)
+
+        pos = self.pos
+        resume = self.resume
+        threads = self.threads
+        candidate = self.candidate
+        spans = []
+
+        while True:
+            if pos <= end and candidate is None and pos >= resume:
+                # a new thread starts here, unless an earlier one got here first
+                if start not in threads:
+                    threads[start] = pos
+                    if finals[start]:
+                        candidate = (pos, pos)
+
+            if pos >= end and eof:
+                # no more input, so no thread gets any further
+                threads = {}
+
+            if not threads:
+                if candidate is not None:
+                    spans.append(candidate)
+
+                    # go back to where the match ended
+                    s, e = candidate
+                    resume = e if e > s else e + 1
+                    pos = resume
+                    candidate = None
+                    continue
+                break
+
+            if pos >= end:
+                break
+
+            b = classes[buffer[pos - base]]
+            pos += 1
+
+            moved = {}
+            for state, s in threads.items():
+                t = table[state * ncols + b]
+                if t >= 0 and (t not in moved or s < moved[t]):
+                    moved[t] = s
+            threads = moved
+
+            for t, s in threads.items():
+                if finals[t]:
+                    if candidate is None or s < candidate[0] or (s == candidate[0] and pos > candidate[1]):
+                        candidate = (s, pos)
+
+            if candidate is not None:
+                # later starts can't win any more
+                threads = { t: s for t, s in threads.items() if s <= candidate[0] }
+
+        # forget the bytes no restart can go back to
+        if candidate is not None:
+            keep = candidate[1]
+        elif threads:
+            keep = min(threads.values())
+        else:
+            keep = pos
+        keep = min(keep, pos, end)
+        del buffer[:keep - base]
+
+        self.base = keep
+        self.pos = pos
+        self.resume = resume
+        self.threads = threads
+        self.candidate = candidate
+        return spans
+
+def finditer(compiled, source, chunk_size=1 << 20):
+    """
+    Yields the match spans of compiled in source, an iterable of bytes
+    chunks or a binary file, reading it one chunk at a time.
+    """
+    if hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(chunk_size), b'')
+    else:
+        chunks = source
+
+    matcher = StreamMatcher(compiled)
+    for chunk in chunks:
+        for span in matcher.feed(chunk):
+            yield span
+    for span in matcher.close():
+        yield span
@@ -0,0 +1,325 @@
+import random
+import re
+import fsm
+import dfa
+import dfafile
+import io
+import stream
+import lexer
+import parallel
+import batch
+import matcher
+import pytest
+
+PATTERNS = [
+    'a',
+    'ab|ac',
+    'a*',
+    '(a|b)*abb',
+    '((a|b)(a|bb))*',
+    '(ab|ba)*',
+    '(a|b)*a(a|b)(a|b)',
+    'a(b|c)*d|e*',
+]
+
+def random_strings(alphabet='abcde', count=200, maxlen=10, seed=0):
+    rand = random.Random(seed)
+    for _ in range(count):
+        yield ''.join(rand.choice(alphabet) for _ in range(rand.randint(0, maxlen)))
+
+def longest_match(regex, s, pos=0):
+    for end in range(len(s), pos - 1, -1):
+        if re.fullmatch(regex, s[pos:end]):
+            return end
+    return None
+
+def leftmost_longest(regex, s):
+    for start in range(len(s) + 1):
+        end = longest_match(regex, s, start)
+        if end is not None:
+            return start, end
+    return None
+
+def test_compiled_dfa_matches_re():
+    for regex in PATTERNS:
+        compiled = fsm.regex_to_dfa(regex).compile()
+        for s in random_strings():
+            assert compiled.fullmatch(s) == bool(re.fullmatch(regex, s))
+            assert compiled.match(s) == longest_match(regex, s)
+            assert compiled.search(s) == leftmost_longest(regex, s)
+
+def test_compiled_dfa_finditer():
+    compiled = fsm.regex_to_dfa('ab*').compile()
+    assert list(compiled.finditer(b'xabbbyaab')) == [(1, 5), (6, 7), (7, 9)]
+    
+    compiled = fsm.regex_to_dfa('a*').compile()
+    assert list(compiled.finditer('baa')) == [(0, 0), (1, 3), (3, 3)]
+
+def test_char_classes_match_re():
+    for regex in ['[a-c]x*', '[^ab]*b', 'a.c|[b-d][^c]', '(.|[ab])*e']:
+        compiled = fsm.regex_to_dfa(regex).compile()
+        for s in random_strings('abcde\nx'):
+            assert compiled.fullmatch(s) == bool(re.fullmatch(regex, s))
+            assert compiled.search(s) == leftmost_longest(regex, s)
+
+@pytest.mark.parametrize('engine', ['dfa', 'nfa', 'lazy', 'derivative'])
+def test_unicode_patterns_match_utf8(engine):
+    for regex in ['é', 'a[α-ω]*b', '[^a]x', '.é*', '(ü|ö)*ß|€']:
+        compiled = matcher.compile(regex, engine)
+        for s in random_strings('aébxαω€üöß\n', count=100):
+            assert compiled.fullmatch(s) == bool(re.fullmatch(regex, s))
+            found = leftmost_longest(regex, s)
+            if found is not None:
+                # spans are in bytes
+                found = tuple(len(s[:i].encode('utf-8')) for i in found)
+            assert compiled.search(s) == found
+
+@pytest.mark.parametrize('engine', ['dfa', 'lazy', 'derivative'])
+def test_prefilter_matches_re(engine):
+    patterns = ['ab(c|d)*e', 'c*(ab|ba)d', '[a-c]*dd', 'x|eb', '.a*e', '(a|b)e(c|d)']
+    for regex in patterns:
+        compiled = matcher.compile(regex, engine)
+        assert compiled.prefilter is not None
+        for s in random_strings('abcdex', count=300, maxlen=16):
+            assert compiled.search(s) == leftmost_longest(regex, s)
+            assert compiled.search(memoryview(s.encode())) == leftmost_longest(regex, s)
+
+def test_byte_classes_share_columns():
+    compiled = fsm.regex_to_dfa('[a-z][a-z]*[0-9]').compile()
+    # [a-z], [0-9] and everything else
+    assert compiled.ncols == 3
+    assert compiled.classes[ord('a')] == compiled.classes[ord('q')]
+    assert compiled.classes[ord('a')] != compiled.classes[ord('0')]
+    assert compiled.fullmatch('abc7') and not compiled.fullmatch('ab')
+    
+    data = dfafile.dumps(compiled)
+    assert len(data) < len(dfafile.dumps(fsm.regex_to_dfa('a').compile())) + 64
+    assert dfafile.loads(data).fullmatch('x1')
+
+def test_compile_rejects_nfa():
+    with pytest.raises(ValueError):
+        dfa.compile(fsm.regex_to_nfa('a*'))
+
+@pytest.mark.parametrize('engine', ['dfa', 'nfa', 'lazy', 'derivative'])
+def test_engines_match_re(engine):
+    for regex in PATTERNS:
+        compiled = matcher.compile(regex, engine)
+        for s in random_strings():
+            assert compiled.fullmatch(s) == bool(re.fullmatch(regex, s))
+            assert compiled.match(s) == longest_match(regex, s)
+            assert compiled.search(s) == leftmost_longest(regex, s)
+        
+        text = ''.join(random_strings(count=20))
+        assert list(compiled.finditer(text)) \
+            == list(fsm.regex_to_dfa(regex).compile().finditer(text))
+
+@pytest.mark.parametrize('engine', ['dfa', 'nfa', 'lazy'])
+def test_glushkov_engines_match_re(engine):
+    for regex in PATTERNS:
+        compiled = matcher.compile(regex, engine, builder='glushkov')
+        for s in random_strings():
+            assert compiled.fullmatch(s) == bool(re.fullmatch(regex, s))
+            assert compiled.search(s) == leftmost_longest(regex, s)
+
+def test_nfa_engine_exponential_pattern():
+    regex = '(a|b)*a' + '(a|b)' * 20
+    compiled = matcher.compile(regex, 'nfa')
+    assert compiled.fullmatch('b' + 'a' * 21)
+    assert not compiled.fullmatch('b' * 21 + 'a')
+    text = 'bbbb' + 'a' * 21 + 'b'
+    assert compiled.search(text) == leftmost_longest(regex, text)
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        matcher.compile('a', 'backtracking')
+
+def test_lazy_dfa_flushes():
+    regex = '(a|b)*a(a|b)(a|b)(a|b)'
+    compiled = matcher.compile(regex, 'lazy', max_states=4)
+    for s in random_strings('ab', maxlen=16):
+        assert compiled.fullmatch(s) == bool(re.fullmatch(regex, s))
+    
+    info = compiled.cache_info()
+    assert info.flushes > 0
+    assert info.states <= 4
+    assert info.hits > 0 and info.misses > 0
+    
+    # with room for every state it never flushes again
+    compiled = matcher.compile(regex, 'lazy')
+    for s in random_strings('ab', maxlen=16):
+        compiled.fullmatch(s)
+    assert compiled.cache_info().flushes == 0
+    assert compiled.cache_info().states == 16
+
+def test_compile_cache():
+    matcher.purge()
+    before = matcher.cache_info()
+    
+    first = matcher.compile('(ab|c)*')
+    assert matcher.compile('(ab|c)*') is first
+    
+    # same language, different spelling
+    assert matcher.compile('(c|ab)*') is first
+    
+    info = matcher.cache_info()
+    assert info.hits - before.hits == 1
+    assert info.misses - before.misses == 2
+    assert info.shared - before.shared == 1
+
+def test_compile_cache_eviction():
+    cache = matcher.PatternCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.info().evictions == 1
+
+def test_binary_round_trip(tmp_path):
+    compiled = fsm.regex_to_dfa('(a|b)*abb').compile()
+    path = str(tmp_path / 'abb.cdfa')
+    dfafile.save(compiled, path)
+    
+    loaded = dfafile.load(path)
+    assert isinstance(loaded.table, memoryview)
+    assert list(loaded.table) == list(compiled.table)
+    for s in random_strings('ab'):
+        assert loaded.fullmatch(s) == compiled.fullmatch(s)
+        assert loaded.search(s) == compiled.search(s)
+
+def test_binary_rejects_garbage():
+    with pytest.raises(ValueError):
+        dfafile.loads(b'not an automaton at all, really not' * 2)
+    
+    data = dfafile.dumps(fsm.regex_to_dfa('ab').compile())
+    with pytest.raises(ValueError):
+        dfafile.loads(data[:-4])
+
+def test_legacy_formats(tmp_path):
+    nfa = dfafile.load_edge_list('nfa.txt')
+    assert (nfa.start, nfa.final) == (0, {5})
+    compiled = fsm.NFADFAConverter(nfa).nfa_to_dfa().compile()
+    assert compiled.fullmatch('aab')
+    assert not compiled.fullmatch('ba')
+    
+    path = tmp_path / 'nfa.txt'
+    with open(str(path), 'w', encoding='utf-8') as f:
+        dfafile.dump_edge_list(nfa, f)
+    assert dfafile.load_edge_list(str(path)).transtable == nfa.transtable
+    
+    nfa = dfafile.load_triple('nfa.json')
+    assert nfa.transtable == {0: [('a', 1)]}
+    path = tmp_path / 'nfa.json'
+    with open(str(path), 'w', encoding='utf-8') as f:
+        dfafile.dump_triple(nfa, f)
+    assert path.read_text(encoding='utf-8') == open('nfa.json').read()
+
+def chunked(data, rand):
+    i = 0
+    while i < len(data):
+        n = rand.randint(0, 7)
+        yield data[i:i + n]
+        i += n
+
+def test_stream_matches_finditer():
+    rand = random.Random(1)
+    for regex in PATTERNS + ['ab*', 'b*', '(a|b)*c']:
+        compiled = fsm.regex_to_dfa(regex).compile()
+        for s in random_strings(count=30, maxlen=60):
+            data = s.encode()
+            expected = list(compiled.finditer(data))
+            assert list(stream.finditer(compiled, chunked(data, rand))) == expected
+            assert list(stream.finditer(compiled, io.BytesIO(data), chunk_size=3)) == expected
+
+def test_stream_buffer_stays_bounded():
+    compiled = fsm.regex_to_dfa('ab*c').compile()
+    matcher = stream.StreamMatcher(compiled)
+    spans = []
+    for i in range(1000):
+        spans += matcher.feed(b'xxabbc' * 10)
+        assert len(matcher.buffer) <= 6
+    spans += matcher.close()
+    assert len(spans) == 10000
+    assert spans[-1] == (59996, 60000)
+
+RULES = [
+    ('IF', 'if'),
+    ('ID', '(a|b|f|i|x)(a|b|f|i|x|0|1)*'),
+    ('NUM', '(0|1)(0|1)*'),
+    ('OP', '=|==|\\*'),
+    ('WS', '  *'),
+]
+
+def test_lexer_maximal_munch():
+    lex = lexer.Lexer(RULES, skip={'WS'})
+    tokens = [(name, text[s:e]) for text in ['if iff == x1*10'] 
+              for name, s, e in lex.tokens(text)]
+    assert tokens == [
+        ('IF', 'if'), ('ID', 'iff'), ('OP', '=='), ('ID', 'x1'), ('OP', '*'), ('NUM', '10'),
+    ]
+    
+    # priority decides ties only, in both orders
+    lex = lexer.Lexer([RULES[1], RULES[0]])
+    assert [name for name, _, _ in lex.tokens('if')] == ['ID']
+
+def test_lexer_errors():
+    lex = lexer.Lexer(RULES)
+    with pytest.raises(lexer.LexError) as info:
+        list(lex.tokens('if ?'))
+    assert info.value.pos == 3
+    
+    with pytest.raises(ValueError):
+        lexer.Lexer([('A', 'a'), ('EMPTY', 'b*')])
+
+def test_tags_survive_serialization():
+    lex = lexer.Lexer(RULES)
+    loaded = dfafile.loads(dfafile.dumps(lex.compiled))
+    assert list(loaded.tags) == list(lex.compiled.tags)
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_parallel_match_ends(tmp_path, processes):
+    data = ''.join(random_strings('abc', count=40, maxlen=15, seed=3)).encode()
+    path = str(tmp_path / 'data')
+    with open(path, 'wb') as f:
+        f.write(data)
+    
+    for regex in ['ab*c', '(a|b)*a(a|b)', 'cc|bab']:
+        anchored = fsm.regex_to_dfa(regex).compile()
+        expected = [
+            e for e in range(1, len(data) + 1) 
+            if any(anchored.fullmatch(data, s, e) for s in range(e))
+        ]
+        compiled = parallel.search_dfa(regex)
+        ends = list(parallel.match_ends(compiled, path, processes, chunk_size=37))
+        assert ends == expected
+
+def test_batch_matches_scalar():
+    pytest.importorskip('numpy')
+    
+    strings = list(random_strings(count=300, maxlen=12, seed=5))
+    for regex in PATTERNS:
+        compiled = fsm.regex_to_dfa(regex).compile()
+        
+        accepted = batch.fullmatch_many(compiled, strings)
+        assert list(accepted) == [compiled.fullmatch(s) for s in strings]
+        
+        ends = batch.match_many(compiled, packed=batch.pack(strings))
+        assert list(ends) == [
+            -1 if compiled.match(s) is None else compiled.match(s) for s in strings
+        ]
+
+def test_bench_reports_every_stage():
+    import json
+    import bench
+    results = bench.run(['exponential'], {'exponential': [2]}, [1024], repeat=1)
+    assert [r['stage'] for r in results] == bench.STAGES + ['match']
+    assert results[-2]['states'] == 8
+    assert all(r['seconds'] >= 0 and r['peak_bytes'] > 0 for r in results)
+    
+    data = io.BytesIO()
+    bench.write_input(data, 'ab', 1024)
+    text = data.getvalue().decode()
+    assert results[-1]['matches'] == sum(
+        1 for end in range(len(text) + 1) if re.search('a(a|b)(a|b)$', text[:end]))
+    json.dumps(results)
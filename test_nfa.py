@@ -1,6 +1,7 @@
 # from unittest import *
 import re
 import fsm
+import reparse as rep
 import pytest
 
 def test_operator():
@@ -11,4 +12,172 @@ def test_regex_to_regextree():
     pass
 
 if __name__ == '__main__':
-    pytest.main()
\ No newline at end of file
+    pytest.main()
+PATTERNS = [
+    'a',
+    'ab|ac',
+    'a*',
+    '(a|b)*abb',
+    '((a|b)(a|bb))*',
+    '(ab|ba)*',
+    '(a|b)*a(a|b)(a|b)',
+    'a(b|c)*d|e*',
+]
+
+def accepts(dfa, s):
+    state = dfa.start
+    for c in s:
+        targets = dfa.move(state, c)
+        if not targets:
+            return False
+        state = targets.pop()
+    return state in dfa.final
+
+def test_minimizers_agree():
+    for regex in PATTERNS:
+        hopcroft = fsm.regex_to_dfa(regex, 'hopcroft')
+        worklist = fsm.regex_to_dfa(regex, 'worklist')
+        assert hopcroft.transtable == worklist.transtable
+        assert hopcroft.start == worklist.start == 0
+        assert hopcroft.final == worklist.final
+
+def test_hopcroft_minimal():
+    dfa = fsm.regex_to_dfa('((a|b)(a|bb))*')
+    assert len(dfa.get_states()) == 3
+    assert accepts(dfa, 'abb')
+    assert accepts(dfa, 'abbba')
+    assert not accepts(dfa, 'ab')
+
+def test_unknown_minimizer():
+    with pytest.raises(ValueError):
+        fsm.NFADFAConverter(fsm.FSM(), 'brzozowski')
+
+def naive_closure(nfa, state):
+    seen = {state}
+    todo = [state]
+    while todo:
+        for t in nfa.move(todo.pop(), None):
+            if t not in seen:
+                seen.add(t)
+                todo.append(t)
+    return seen
+
+def test_closure_table():
+    for regex in PATTERNS + ['(a*)*', '((a|b*)*c*)*']:
+        nfa = fsm.regex_to_nfa(regex)
+        converter = fsm.NFADFAConverter(nfa)
+        for s in nfa.get_states():
+            assert converter.ep_closure({s}) == naive_closure(nfa, s)
+
+def test_indexed_fsm():
+    nfa = fsm.regex_to_nfa('(a|b)*abb')
+    indexed = nfa.to_indexed()
+    assert indexed.get_states() == nfa.get_states()
+    assert indexed.get_alphabet() == {'a', 'b'}
+    for s in nfa.get_states():
+        for c in (None, 'a', 'b'):
+            assert indexed.move(s, c) == nfa.move(s, c)
+    
+    round_trip = indexed.to_fsm()
+    assert {s: sorted(t, key=repr) for s, t in round_trip.transtable.items()} \
+        == {s: sorted(t, key=repr) for s, t in nfa.transtable.items()}
+    assert (round_trip.start, round_trip.final) == (nfa.start, nfa.final)
+
+def test_minimizers_keep_tags_apart():
+    import lexer
+    nfa = lexer.rules_to_nfa(['ab', 'a(b|c)', 'c*'])
+    hopcroft = fsm.NFADFAConverter(nfa.to_fsm(), 'hopcroft').nfa_to_dfa()
+    worklist = fsm.NFADFAConverter(nfa.to_fsm(), 'worklist').nfa_to_dfa()
+    assert hopcroft.transtable == worklist.transtable
+    assert hopcroft.tags == worklist.tags
+    
+    # 'ab' is rule 0, 'ac' only rule 1, and both ends must stay distinct
+    ab = hopcroft.move(hopcroft.move(0, 'a').pop(), 'b').pop()
+    ac = hopcroft.move(hopcroft.move(0, 'a').pop(), 'c').pop()
+    assert (hopcroft.tags[ab], hopcroft.tags[ac]) == (0, 1)
+    assert hopcroft.tags[0] == 2
+
+def test_thompson_handles_huge_trees():
+    converter = fsm.RegexNFAConverter('ab' * 30000 + '|c*')
+    assert fsm.thompson_size(converter.tree) == (60002, 60005)
+    
+    nfa = converter.tree_to_nfa()
+    assert len(nfa.get_states()) == 60004
+    assert nfa.get_alphabet() == {'a', 'b', 'c'}
+
+def test_empty_alternative_matches_empty_string():
+    dfa = fsm.regex_to_dfa('a|')
+    assert accepts(dfa, 'a')
+    assert accepts(dfa, '')
+    assert accepts(fsm.regex_to_dfa(''), '')
+
+def test_utf8_sequences():
+    import itertools
+    import utf8
+    for lo, hi in [(0, 0x7F), (0x7F, 0x800), (0x400, 0x4FF), (0xD000, 0xE100), (0xFFF0, 0x10010)]:
+        encoded = set()
+        for run in utf8.sequences(lo, hi):
+            encoded.update(bytes(b) for b in itertools.product(*[range(a, z + 1) for a, z in run]))
+        assert encoded == {chr(c).encode('utf-8') for c in range(lo, hi + 1)
+                           if not 0xD800 <= c <= 0xDFFF}
+
+def test_utf8_nfa_shares_suffixes():
+    # Cyrillic is [d0-d3][80-bf], one tail state for all four lead bytes
+    nfa = fsm.RegexNFAConverter('[Ѐ-ӿ]').tree_to_nfa()
+    assert len(nfa.get_states()) == 3
+    assert all(ord(c) < 256 for c in nfa.get_alphabet() if type(c) is str)
+    
+    nfa = fsm.RegexNFAConverter('[Ѐ-ӿ]', utf8=False).tree_to_nfa()
+    assert nfa.get_alphabet() == {rep.CharSet([(0x400, 0x4FF)])}
+
+def test_compile_is_silent(capsys):
+    fsm.regex_to_dfa('(a|b)*abb')
+    assert capsys.readouterr() == ('', '')
+
+def test_compile_stats():
+    import instrument
+    finished = []
+    stats = instrument.CompileStats(trace_memory=True,
+                                    callback=lambda stage, seconds, stats: finished.append(stage))
+    fsm.regex_to_dfa('(a|b)*a(a|b)(a|b)', stats=stats)
+    
+    assert finished == ['parse', 'thompson', 'closures', 'subset', 'minimize']
+    assert set(stats.peak_memory) == set(finished)
+    assert stats.counts['dfa_states'] == stats.counts['min_dfa_states'] == 8
+    assert stats.counts['nfa_states'] > 8
+    assert stats.counts['refinement_rounds'] > 0
+    assert stats.as_dict()['subset_seconds'] >= 0
+
+def test_glushkov_builder():
+    for regex in PATTERNS + ['', 'a|', '(a*)*b', '[a-c]x*é']:
+        thompson = fsm.regex_to_dfa(regex)
+        glushkov = fsm.regex_to_dfa(regex, builder='glushkov')
+        assert thompson.fingerprint() == glushkov.fingerprint()
+    
+    # a state per position plus the start, and no ε-edges to close over
+    nfa = fsm.RegexNFAConverter('(a|b)*a(a|b)(a|b)').build('glushkov')
+    assert len(nfa.get_states() | {nfa.start}) == 8
+    assert not nfa.epsilon
+    table = fsm.ClosureTable(nfa)
+    assert all(table.closures[b] == b for b in table.bit.values())
+    
+    with pytest.raises(ValueError):
+        fsm.RegexNFAConverter('a').build('brzozowski')
+
+def test_derivative_dfa():
+    import derivative
+    for regex in PATTERNS + ['', 'a|', '(a*)*b', 'abc|abd|xbc']:
+        dfa = derivative.regex_to_dfa(regex)
+        assert len(dfa.get_states() | {0}) == len(fsm.regex_to_dfa(regex).get_states() | {0})
+        for s in ['', 'a', 'ab', 'abb', 'abab', 'abc', 'aabb', 'ebcd', 'b', 'bab']:
+            assert accepts(dfa, s) == bool(re.fullmatch(regex, s))
+    
+    # smart constructors: a|a, (a*)*, aε∅|b all collapse
+    terms = derivative.Derivatives(rep.REParser('a').parse())
+    a = terms.start
+    assert terms.alt([a, a]) == a
+    assert terms.star(terms.star(a)) == terms.star(a)
+    assert terms.alt([terms.seq([a, terms.EPSILON, terms.EMPTY]), terms.EMPTY]) == terms.EMPTY
+    
+    with pytest.raises(ValueError):
+        derivative.regex_to_dfa('(a|b)*a(a|b)(a|b)', max_states=4)
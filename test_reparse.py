@@ -0,0 +1,103 @@
+import reparse as rep
+import pytest
+
+def depth(tree):
+    deepest = 0
+    todo = [(tree, 1)]
+    while todo:
+        node, d = todo.pop()
+        deepest = max(deepest, d)
+        for child in ('a', 'b'):
+            if hasattr(node, child):
+                todo.append((getattr(node, child), d + 1))
+    return deepest
+
+def parse(regex):
+    return rep.REParser(regex).parse()
+
+def test_parse_structure():
+    assert str(parse('(ab)*|cd')) == "(|, (*, (&, 'a', 'b')), (&, 'c', 'd'))"
+    assert str(parse('a\\*b*')) == "(&, (&, 'a', '*'), (*, 'b'))"
+    assert str(parse('a|')) == "(|, 'a', '')"
+    assert str(parse('*a')) == "(&, '*', 'a')"
+    assert repr(parse('')) == 'RegEx()'
+
+def test_parse_is_balanced():
+    literals = ['w{}'.format(i) for i in range(5000)]
+    tree = parse('|'.join(literals))
+    assert depth(tree) < 20
+    
+    tree = parse('(' * 3000 + 'a' + ')' * 3000)
+    assert repr(tree) == 'Primitive(a)'
+    
+    tree = parse('ab' * 20000)
+    assert depth(tree) < 20
+
+def test_char_classes():
+    assert str(parse('[a-z0-9]')) == '[0-9a-z]'
+    assert str(parse('x[\\]-]*')) == "(&, 'x', (*, [\\-\\]]))"
+    
+    chars = parse('[^a-c]').chars
+    assert 'a' not in chars and 'd' in chars and 0x10FFFF in chars
+    assert len(chars) == rep.MAX_CHAR + 1 - 3
+    assert chars.negate() == rep.CharSet.of('abc')
+    
+    assert '\n' not in parse('.').chars
+    assert rep.CharSet([(5, 9), (0, 3), (4, 4)]).ranges == ((0, 9),)
+
+@pytest.mark.parametrize('regex, pos', [
+    ('ab)c', 2),
+    ('a(b(c)', 1),
+    ('ab\\', 3),
+    ('a[bc', 1),
+    ('[z-a]', 1),
+])
+def test_parse_errors(regex, pos):
+    with pytest.raises(rep.ParseError) as info:
+        parse(regex)
+    assert info.value.pos == pos
+    assert 'position {}'.format(pos) in str(info.value)
+
+def test_required_literals():
+    import literals
+    info = literals.analyze(parse('(ERROR|WARN): [a-z]*'))
+    assert info.prefixes == {b'ERROR: ', b'WARN: '}
+    assert not info.nullable
+    
+    info = literals.analyze(parse('[0-9]*GET /api/[a-z]*'))
+    assert info.inner == b'GET /api/'
+    assert info.prefixes == {b''}
+    
+    info = literals.analyze(parse('x(a|b)*yz'))
+    assert (info.prefixes, info.suffixes) == ({b'x'}, {b'yz'})
+    assert info.first == {ord('x')}
+    
+    assert literals.analyze(parse('é')).first == {0xC3}
+    assert literals.prefilter(parse('a*|b')) is None
+
+def test_nodes_are_interned():
+    import copy
+    import gc
+    import pickle
+    
+    a = parse('(ab|c)*d')
+    b = parse('(ab|c)*d')
+    assert a is b
+    assert parse('ab|ab').a is parse('ab|ab').b
+    assert rep.Concat(rep.Primitive('a'), rep.Primitive('b')) is parse('ab')
+    assert {a: 1}[b] == 1
+    assert parse('ab') != parse('ba')
+    
+    with pytest.raises(AttributeError):
+        a.a = rep.Primitive('x')
+    assert not hasattr(a, '__dict__')
+    
+    assert copy.deepcopy(a) is a
+    assert pickle.loads(pickle.dumps(a)) is a
+    assert tuple(a) == tuple(b) == ('&', ('*', ('|', ('&', ('a',), ('b',)), ('c',))), ('d',))
+    
+    # the table doesn't keep trees alive
+    before = len(rep.RegEx._interned)
+    parse('q' * 100)
+    gc.collect()
+    assert len(rep.RegEx._interned) <= before
@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+"""
+Code point ranges as UTF-8 byte sequences.
+
+A range of code points splits into a few runs whose encodings are a range
+of bytes at every position, like [\\u0400-\\u04ff] -> [d0-d3][80-bf]. Each
+run is a list of (lo, hi) byte ranges, one per encoded byte.
+"""
+
+# the last code point of each encoded length
+BOUNDARIES = (0x7F, 0x7FF, 0xFFFF)
+
+SURROGATES = (0xD800, 0xDFFF)
+
+def sequences(lo, hi):
+    """
+    Yields the byte range runs that together encode exactly the code
+    points lo..hi, in order. Surrogates have no encoding and are left out.
+    """
+    # a stack of code point ranges, the next one to split on top
+    todo = [(lo, hi)]
+    while todo:
+        lo, hi = todo.pop()
+
+        if lo <= SURROGATES[1] and hi >= SURROGATES[0]:
+            if hi > SURROGATES[1]:
+                todo.append((SURROGATES[1] + 1, hi))
+            if lo < SURROGATES[0]:
+                todo.append((lo, SURROGATES[0] - 1))
+            continue
+
+        split = _split(lo, hi)
+        if split is not None:
+            todo.append((split + 1, hi))
+            todo.append((lo, split))
+            continue
+
+        yield list(zip(encode(lo), encode(hi)))
+
+def _split(lo, hi):
+    """
+    Where lo..hi has to be cut so that each side encodes to the same length
+    with full continuation byte ranges, or None if it doesn't.
+    """
+    for boundary in BOUNDARIES:
+        if lo <= boundary < hi:
+            return boundary
+
+    if hi <= BOUNDARIES[0]:
+        return None
+
+    for i in range(1, 4):
+        m = (1 << (6 * i)) - 1
+        if lo & ~m != hi & ~m:
+            if lo & m:
+                return lo | m
+            if hi & m != m:
+                return (hi & ~m) - 1
+    return None
+
+def encode(c):
+    return chr(c).encode('utf-8')